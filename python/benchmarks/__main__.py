@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks for the PS-side hot paths, run off the board with fake Pynq objects.
+
+Run from the `python` directory:
+
+    python -m benchmarks [--save-baseline] [--baseline PATH] [--output PATH] [--filter TEXT]
+
+Results are compared against the baseline, and the exit status is 1 if any benchmark is slower than the
+baseline by more than the tolerance, or if a baseline given with --baseline doesn't exist. The default
+baseline is recorded per machine with --save-baseline, and a warning is printed if there isn't one.
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import lzma
+from pathlib import Path
+import platform
+import sys
+import tempfile
+import threading
+import timeit
+from typing import Callable, Dict, Iterator, Tuple
+import zipfile
+
+from . import fake_pynq
+fake_pynq.install()
+
+from PIL import Image
+
+from gameboy_ps import history, library, session, ui
+from gameboy_ps.gameboy import Gameboy, RomHeader, RtcState
+
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+Benchmark = Tuple[str, Callable[[], None]]
+
+
+class BenchSystem:
+    """Minimal stand-in for `System`, without controllers or background services."""
+
+    def __init__(self, rom_directory: Path) -> None:
+        self.rom_directory = rom_directory
+        self.library = library.RomLibrary(rom_directory)
+        self.rom_cache = None
+        self.session = session.Session(rom_directory)
+        self.preload = None
+        self.history = history.History(rom_directory)
+        self.input_recorder = None
+        self.input_replayer = None
+        self.gameboy = Gameboy()
+        self.ui_lock = threading.RLock()
+        self.ui = ui.UI(self)
+
+    def load_rom(self, rom_path: Path) -> None:
+        self.gameboy.set_emulated_cartridge(rom_path)
+
+    def begin_play(self) -> None:
+        self.gameboy.reset()
+
+    def end_play(self) -> None:
+        pass
+
+
+def make_rom(cartridge_type: int = 0x1B, rom_size_code: int = 0, ram_size_code: int = 0) -> bytes:
+    rom_size = 32 * 1024 * (1 << rom_size_code)
+    data = bytearray((i * 7) & 0xFF for i in range(rom_size))
+    data[0x147] = cartridge_type
+    data[0x148] = rom_size_code
+    data[0x149] = ram_size_code
+    return bytes(data)
+
+
+def bench_convert_image(system: BenchSystem, directory: Path) -> Iterator[Benchmark]:
+    logo = Image.open(Path(ui.resources.__path__[0]) / "logo.png")
+    logo.load()
+    yield "convert_image.logo", lambda: ui.convert_image(logo)
+
+
+def bench_screens(system: BenchSystem, directory: Path) -> Iterator[Benchmark]:
+    main_menu = ui.MainMenuScreen(system.ui)
+
+    def render_main_menu_uncached():
+        system.ui._frame_cache.clear()
+        main_menu._render()
+
+    yield "render.main_menu", main_menu._render
+    yield "render.main_menu_uncached", render_main_menu_uncached
+
+    game = ui.GameScreen(system.ui)
+    game.playing = False
+    yield "render.game_menu", game._render
+    yield "render.stats", ui.StatsScreen(system.ui, game)._render
+    yield "render.options", ui.OptionsScreen(system.ui)._render
+
+    rom_select = ui.RomSelectScreen(system.ui)
+    yield "render.rom_select", rom_select._render
+
+    def render_rom_select_error():
+        rom_select._error = "Unsupported cart 0xff"
+        rom_select._render()
+        rom_select._error = None
+
+    yield "render.rom_select_error", render_rom_select_error
+
+
+def bench_list_widget(system: BenchSystem, directory: Path) -> Iterator[Benchmark]:
+    for count in (100, 5000):
+        widget = ui.ListWidget([f"Some Long Game Title Number {i} (USA, Europe).gbc" for i in range(count)], lines=9)
+
+        def render(widget=widget):
+            widget.move_down()
+            widget.render(system.ui, 6, 18, 150, 108)
+
+        yield f"list_widget.render.{count}", render
+
+
+def bench_framebuffer(system: BenchSystem, directory: Path) -> Iterator[Benchmark]:
+    frame = ui.image_to_frame(system.ui.framebuffer)
+    yield "framebuffer.image_to_frame", lambda: ui.image_to_frame(system.ui.framebuffer)
+    yield "framebuffer.copy_framebuffer", lambda: system.gameboy.copy_framebuffer(frame)
+    hud_frame = ui.image_to_frame(system.ui.hud.image)
+    yield "framebuffer.copy_overlay", lambda: system.gameboy.copy_overlay(hud_frame)
+
+
+def bench_rom_header(system: BenchSystem, directory: Path) -> Iterator[Benchmark]:
+    header = make_rom(0x10, 0, 3)[:0x150]
+    yield "rom_header.parse", lambda: RomHeader(header)
+
+
+def bench_rom_load(system: BenchSystem, directory: Path) -> Iterator[Benchmark]:
+    # 1 MiB ROM, with 32 KiB RAM
+    data = make_rom(0x1B, 5, 3)
+    paths = {
+        "raw": directory / "load.gb",
+        "gz": directory / "load.gb.gz",
+        "xz": directory / "load.gb.xz",
+        "zip": directory / "load.zip",
+    }
+    paths["raw"].write_bytes(data)
+    paths["gz"].write_bytes(gzip.compress(data))
+    paths["xz"].write_bytes(lzma.compress(data))
+    with zipfile.ZipFile(paths["zip"], "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("load.gb", data)
+
+    for (kind, path) in paths.items():
+        yield f"rom_load.{kind}", lambda path=path: system.gameboy.set_emulated_cartridge(path)
+
+
+def bench_persist_ram(system: BenchSystem, directory: Path) -> Iterator[Benchmark]:
+    configs = {
+        "mbc2_512": (0x06, 0),
+        "8k": (0x1B, 2),
+        "32k": (0x1B, 3),
+        "64k": (0x1B, 5),
+        "128k": (0x1B, 4),
+        "32k_rtc": (0x10, 3),
+    }
+    for (name, (cartridge_type, ram_size_code)) in configs.items():
+        path = directory / f"persist_{name}.gb"
+        path.write_bytes(make_rom(cartridge_type, 0, ram_size_code))
+
+        def persist(path=path):
+            # Loading is untimed setup, but the loaded cartridge must be the right one.
+            if getattr(system.gameboy, "_save_path", None) != path.with_suffix(".sav"):
+                system.gameboy.set_emulated_cartridge(path)
+            system.gameboy.persist_ram()
+
+        persist()
+        yield f"persist_ram.{name}", persist
+
+
+def bench_rtc(system: BenchSystem, directory: Path) -> Iterator[Benchmark]:
+    state = RtcState.from_fpga(0x0ABCDEF)
+    disk = state.to_disk()
+
+    def advance():
+        s = RtcState.from_disk(disk)
+        s.advance(123456789)
+
+    yield "rtc.from_fpga", lambda: RtcState.from_fpga(0x0ABCDEF)
+    yield "rtc.to_fpga", state.to_fpga
+    yield "rtc.from_disk", lambda: RtcState.from_disk(disk)
+    yield "rtc.to_disk", state.to_disk
+    yield "rtc.advance", advance
+
+
+BENCHMARKS = [
+    bench_convert_image,
+    bench_screens,
+    bench_list_widget,
+    bench_framebuffer,
+    bench_rom_header,
+    bench_rom_load,
+    bench_persist_ram,
+    bench_rtc,
+]
+
+
+def measure(func: Callable[[], None], repeat: int) -> float:
+    """Get the best time (in seconds) per call."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--baseline", type=Path, help=f"baseline results to compare against (default: {DEFAULT_BASELINE.name})"
+    )
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--output", type=Path, help="write the results to this file")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown relative to the baseline")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='[%(levelname)s] %(message)s', level=logging.WARNING)
+
+    baseline_path = args.baseline if args.baseline is not None else DEFAULT_BASELINE
+    baseline: Dict[str, float] = {}
+    if not args.save_baseline:
+        if baseline_path.is_file():
+            baseline = json.loads(baseline_path.read_text())["results"]
+        elif args.baseline is not None:
+            print(f"Baseline {baseline_path} does not exist", file=sys.stderr)
+            return 1
+        else:
+            print(
+                f"No baseline at {baseline_path}, so regressions can't be detected. "
+                "Record one with --save-baseline.",
+                file=sys.stderr,
+            )
+
+    results: Dict[str, float] = {}
+    regressions = []
+    with tempfile.TemporaryDirectory() as temp:
+        directory = Path(temp)
+        # A ROM library for the ROM select screen.
+        for i in range(200):
+            (directory / f"Game {i:03}.gb").write_bytes(b"")
+        system = BenchSystem(directory)
+
+        for benchmarks in BENCHMARKS:
+            for (name, func) in benchmarks(system, directory):
+                if args.filter not in name:
+                    continue
+                results[name] = seconds = measure(func, args.repeat)
+                line = f"{name:40} {seconds * 1e6:12.1f} us"
+                if name in baseline:
+                    ratio = seconds / baseline[name]
+                    line += f"  ({ratio:0.2f}x baseline)"
+                    if ratio > 1 + args.tolerance:
+                        line += "  REGRESSION"
+                        regressions.append(name)
+                print(line, flush=True)
+
+    output = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    if args.output is not None:
+        args.output.write_text(json.dumps(output, indent=2) + "\n")
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(output, indent=2) + "\n")
+        print(f"Saved baseline to {baseline_path}")
+
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed by more than {args.tolerance:.0%}:", file=sys.stderr)
+        for name in regressions:
+            print(f"  {name}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Stand-ins for the Pynq objects used by `gameboy_ps`, so that the PS code can run off the board.
+
+`install()` must be called before `gameboy_ps.gameboy` is imported.
+"""
+
+import sys
+import types
+
+import numpy as np
+
+
+class FakeBuffer(np.ndarray):
+    """Contiguous buffer, like those returned by `pynq.allocate`."""
+    device_address = 0x1000_0000
+
+    def sync_to_device(self) -> None:
+        pass
+
+    def sync_from_device(self) -> None:
+        pass
+
+    def freebuffer(self) -> None:
+        pass
+
+
+def allocate(shape, dtype="uint32", **kwargs) -> FakeBuffer:
+    return np.zeros(shape, dtype=dtype).view(FakeBuffer)
+
+
+class MMIO:
+    """Register file that reads back what was written. Blits complete immediately."""
+
+    def __init__(self, base_addr: int, length: int = 4) -> None:
+        self._registers = {}
+
+    def read(self, offset: int = 0, length: int = 4) -> int:
+        # Blit control (register 64): the blit finishes as soon as it is started.
+        if offset == 64 * 4:
+            return 0
+        return self._registers.get(offset, 0)
+
+    def write(self, offset: int, value: int) -> None:
+        self._registers[offset] = value
+
+
+class GPIO:
+    def __init__(self, gpio_index: int, direction: str) -> None:
+        self.value = 0
+
+    @staticmethod
+    def get_gpio_pin(gpio_user_index: int, target_label=None) -> int:
+        return gpio_user_index
+
+    def write(self, value: int) -> None:
+        self.value = value
+
+
+class Overlay:
+    def __init__(self, bitfile_name: str, **kwargs) -> None:
+        self.bitfile_name = bitfile_name
+
+
+def install() -> None:
+    """Install the fake `pynq` module, and fakes for the controller libraries if they are missing."""
+    pynq = types.ModuleType("pynq")
+    pynq.allocate = allocate
+    pynq.MMIO = MMIO
+    pynq.GPIO = GPIO
+    pynq.Overlay = Overlay
+    sys.modules["pynq"] = pynq
+
+    try:
+        import xbox360controller
+    except ImportError:
+        module = types.ModuleType("xbox360controller")
+        module.Xbox360Controller = None
+        sys.modules["xbox360controller"] = module
+    try:
+        import smbus2
+    except ImportError:
+        module = types.ModuleType("smbus2")
+        module.SMBus = None
+        sys.modules["smbus2"] = module
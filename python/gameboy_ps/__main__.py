@@ -8,11 +8,43 @@ Must be run as root.
 
 import logging
 logging.basicConfig(format='[%(asctime)s][%(levelname)s] %(message)s', level=logging.DEBUG)
+import os
 import sys
 from pathlib import Path
 
-from . import system
+from . import library, romfile, session
 
 rom_directory = Path(sys.argv[1])
-system = system.System(rom_directory)
+library_roots = os.environ.get("GAMEBOY_PS_LIBRARY_ROOTS")
+rom_library = library.RomLibrary(
+    rom_directory,
+    slow_roots=[Path(p) for p in library_roots.split(os.pathsep) if p] if library_roots else [],
+)
+cache_directory = os.environ.get("GAMEBOY_PS_ROM_CACHE")
+rom_cache = romfile.ImageCache(Path(cache_directory)) if cache_directory else None
+
+# Start reading the last game now, while the Pynq libraries and the overlay load.
+last_session = session.Session.load(rom_directory)
+preload = None
+if last_session.can_resume and last_session.cartridge == session.CartridgeMode.EMULATED:
+    last_rom_path = last_session.last_rom_path
+    preload = session.Preload(last_rom_path, rom_cache if rom_library.should_cache(last_rom_path) else None)
+
+from . import system
+
+trace_path = os.environ.get("GAMEBOY_PS_TRACE")
+control_socket = os.environ.get("GAMEBOY_PS_CONTROL_SOCKET")
+control_http_port = os.environ.get("GAMEBOY_PS_CONTROL_HTTP_PORT")
+render_process = os.environ.get("GAMEBOY_PS_RENDER_PROCESS")
+system = system.System(
+    rom_directory,
+    trace_path=Path(trace_path) if trace_path else None,
+    rom_cache=rom_cache,
+    last_session=last_session,
+    preload=preload,
+    control_socket=Path(control_socket) if control_socket else None,
+    control_http_port=int(control_http_port) if control_http_port else None,
+    rom_library=rom_library,
+    render_process=bool(render_process),
+)
 system.start()
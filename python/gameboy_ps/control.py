@@ -0,0 +1,177 @@
+"""
+Local control API, for driving the system from scripts and test rigs.
+
+Requests are JSON objects naming a command and its arguments, e.g. {"command": "button", "button": "A", "pressed": true}.
+Responses are JSON objects: {"ok": true, "result": ...} or {"ok": false, "error": "..."}.
+
+Two transports are supported:
+- A Unix socket, with one request/response per line.
+- (Optionally) HTTP on localhost, as `GET /<command>?<arg>=<value>` or `POST /<command>` with the arguments as a JSON body.
+"""
+
+import asyncio
+import functools
+import json
+import logging
+from pathlib import Path
+import threading
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+from .controller import Button
+from .gameboy import RomLoadException
+
+
+class ControlError(Exception):
+    pass
+
+
+class ControlServer:
+    def __init__(self, system: "System", socket_path: Path, http_port: Optional[int] = None) -> None:
+        self.system = system
+        self.socket_path = socket_path
+        self.http_port = http_port
+
+    def start(self) -> None:
+        """Start serving in a background thread."""
+        t = threading.Thread(target=lambda: asyncio.run(self._serve()), daemon=True)
+        t.start()
+
+    async def _serve(self) -> None:
+        if self.socket_path.is_socket():
+            self.socket_path.unlink()
+        servers = [await asyncio.start_unix_server(self._handle_stream, path=str(self.socket_path))]
+        logging.info("Control API listening on %s", self.socket_path)
+        if self.http_port is not None:
+            servers.append(await asyncio.start_server(self._handle_http, host="127.0.0.1", port=self.http_port))
+            logging.info("Control API listening on http://127.0.0.1:%d", self.http_port)
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+
+    async def _handle_stream(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    response = {"ok": False, "error": f"Invalid request: {e}"}
+                else:
+                    response = await self._execute(request)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            if len(request_line) < 2:
+                response = {"ok": False, "error": "Invalid request"}
+            else:
+                url = urlsplit(request_line[1])
+                request = {k: _parse_query_value(v) for (k, v) in parse_qsl(url.query)}
+                try:
+                    if body:
+                        request.update(json.loads(body))
+                except ValueError as e:
+                    response = {"ok": False, "error": f"Invalid request: {e}"}
+                else:
+                    request["command"] = url.path.strip("/")
+                    response = await self._execute(request)
+
+            status = "200 OK" if response["ok"] else "400 Bad Request"
+            content = json.dumps(response).encode()
+            writer.write(
+                f"HTTP/1.0 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(content)}\r\n\r\n"
+                .encode() + content
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _execute(self, request: Any) -> Dict[str, Any]:
+        if not isinstance(request, dict):
+            return {"ok": False, "error": "Request must be a JSON object"}
+        handler = getattr(self, f"_command_{request.get('command')}", None)
+        if handler is None:
+            return {"ok": False, "error": f"Unknown command: {request.get('command')}"}
+        # Commands block on register I/O (and sometimes rendering), so run them off the event loop.
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(None, functools.partial(handler, request))
+        except (ControlError, RomLoadException, KeyError, ValueError) as e:
+            return {"ok": False, "error": str(e)}
+        except Exception as e:
+            # Unexpected errors (e.g. a save that couldn't be written) are still reported to the client.
+            logging.exception("Error executing %s", request.get("command"))
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        return {"ok": True, "result": result}
+
+    def _command_roms(self, request: Dict[str, Any]) -> Any:
+        library = self.system.library
+        return [library.name(p) for p in library.list_roms()]
+
+    def _command_load_rom(self, request: Dict[str, Any]) -> Any:
+        # Only ROMs in the library can be loaded.
+        rom_path = self.system.library.find(request["path"])
+        if rom_path is None:
+            raise ControlError(f"No such ROM: {request['path']}")
+        with self.system.ui_lock:
+            self.system.ui.start_rom(rom_path)
+
+    def _command_load_cartridge(self, request: Dict[str, Any]) -> Any:
+        with self.system.ui_lock:
+            self.system.ui.start_cartridge()
+
+    def _command_reset(self, request: Dict[str, Any]) -> Any:
+        with self.system.ui_lock:
+            self.system.begin_play()
+
+    def _command_pause(self, request: Dict[str, Any]) -> Any:
+        # Goes through the UI, so that pausing shows the pause menu (and saves), just like HOME.
+        with self.system.ui_lock:
+            if not self.system.ui.set_paused(_get_bool(request, "paused")):
+                raise ControlError("No game is running")
+
+    def _command_button(self, request: Dict[str, Any]) -> Any:
+        # Handled just like a controller, so it can also be used to navigate the UI.
+        button = Button[str(request["button"]).upper()]
+        self.system.on_button(button, _get_bool(request, "pressed"))
+
+    def _command_persist_ram(self, request: Dict[str, Any]) -> Any:
+        # Saving pauses the game, and must not unpause it under a pause menu opened meanwhile.
+        with self.system.ui_lock:
+            self.system.gameboy.persist_ram()
+
+    def _command_stats(self, request: Dict[str, Any]) -> Any:
+        gameboy = self.system.gameboy
+        stats = gameboy.get_stats()
+        stats["playtime"] = gameboy.get_playtime()
+        return stats
+
+    def _command_debug(self, request: Dict[str, Any]) -> Any:
+        return self.system.gameboy.get_debug()
+
+
+def _get_bool(request: Dict[str, Any], name: str, default: bool = True) -> bool:
+    value = request.get(name, default)
+    if not isinstance(value, bool):
+        raise ControlError(f"{name} must be true or false")
+    return value
+
+
+def _parse_query_value(value: str) -> Any:
+    # Allow e.g. `pressed=false` in query strings.
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
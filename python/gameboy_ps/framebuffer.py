@@ -0,0 +1,53 @@
+"""
+Frame dimensions, and frames shared between processes.
+
+This module must not depend on Pynq, so that the UI can run in a process without it.
+"""
+
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+
+WIDTH = 160
+HEIGHT = 144
+# Height of the overlay strip, which is drawn over the running game
+OVERLAY_LINES = 10
+
+
+class SharedFramebuffer:
+    """
+    Frames (and an overlay strip) in shared memory, in the PL framebuffer format.
+
+    The render process draws into a free frame slot, then hands the slot over by its sequence number
+    (frame `seq` is in slot `seq % FRAME_SLOTS`), so frames are never copied between processes.
+    """
+    FRAME_SLOTS = 2
+
+    def __init__(self, name: Optional[str] = None) -> None:
+        """Create the shared memory, or attach to existing shared memory by name."""
+        frames_size = self.FRAME_SLOTS * HEIGHT * WIDTH * 2
+        overlay_size = OVERLAY_LINES * WIDTH * 2
+        if name is None:
+            self._memory = shared_memory.SharedMemory(create=True, size=(frames_size + overlay_size))
+        else:
+            self._memory = shared_memory.SharedMemory(name=name)
+        self.frames = np.ndarray((self.FRAME_SLOTS, HEIGHT, WIDTH), dtype=np.uint16, buffer=self._memory.buf)
+        self.overlay = np.ndarray(
+            (OVERLAY_LINES, WIDTH), dtype=np.uint16, buffer=self._memory.buf, offset=frames_size
+        )
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+
+    def frame(self, seq: int) -> np.ndarray:
+        return self.frames[seq % self.FRAME_SLOTS]
+
+    def close(self, unlink: bool = False) -> None:
+        # The arrays must be released before the memory can be closed.
+        del self.frames
+        del self.overlay
+        self._memory.close()
+        if unlink:
+            self._memory.unlink()
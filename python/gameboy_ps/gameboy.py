@@ -1,24 +1,28 @@
 #!/usr/bin/env python3
 
+import contextlib
 import importlib.resources
+import io
 import logging
+import os
 import time
 from pathlib import Path
 import struct
-from typing import Dict
+import threading
+from typing import Dict, Optional
+import zlib
 
 logging.info("Loading Pynq libraries...")
 from pynq import allocate, GPIO, MMIO, Overlay
 import numpy as np
 logging.info("Finished loading Pynq libraries")
 
-from PIL import Image
-
 from . import controller
+from .framebuffer import WIDTH, HEIGHT, OVERLAY_LINES
 from . import resources
-
-WIDTH = 160
-HEIGHT = 144
+from . import romfile
+from .romfile import RomLoadException
+from . import trace
 
 REGISTER_MMIO_ADDR = 0x43C0_0000
 # Control
@@ -34,6 +38,7 @@ REGISTER_RTC_LATCHED = 38 * 4
 # Framebuffer
 REGISTER_BLIT_CONTROL = 64 * 4
 REGISTER_BLIT_ADDRESS = 65 * 4
+REGISTER_OVERLAY_CONTROL = 66 * 4
 # Debug
 REGISTER_DEBUG_CPU1 = 96 * 4
 REGISTER_DEBUG_CPU2 = 97 * 4
@@ -45,6 +50,13 @@ REGISTER_STAT_CLOCKS = 129 * 4
 REGISTER_STAT_CACHE_HITS = 130 * 4
 REGISTER_STAT_CACHE_MISSES = 131 * 4
 
+STAT_REGISTERS = {
+    "stalls": REGISTER_STAT_STALLS,
+    "clocks": REGISTER_STAT_CLOCKS,
+    "cache_hits": REGISTER_STAT_CACHE_HITS,
+    "cache_misses": REGISTER_STAT_CACHE_MISSES,
+}
+
 
 
 JOYPAD_BUTTONS = [
@@ -54,14 +66,24 @@ JOYPAD_BUTTONS = [
 
 class Gameboy:
     CLOCK_RATE = 8 * 1024 * 1024
+    # The stat registers are 32 bits and overflow (the clocks register in 8.53 minutes), so they are
+    # read at least this often to extend them to 64 bits.
+    STATS_POLL_INTERVAL = 60.0
 
     def __init__(self) -> None:
         self._paused = True
         self._reset = False
         self._emu_cartridge = False
         self._blit_active = False
+        # Blits can be started from the UI thread and the HUD thread.
+        self._blit_lock = threading.RLock()
         self._duration_playing = 0.0
         self._time_unpaused = None
+        self._stats_lock = threading.Lock()
+        self._stats_total = {name: 0 for name in STAT_REGISTERS}
+        self._stats_last = {name: 0 for name in STAT_REGISTERS}
+        self.rom_crc32 = None
+        self.rom_load_time = None
         
         # Load the overlay
         logging.info("Loading overlay...")
@@ -69,7 +91,8 @@ class Gameboy:
         with importlib.resources.as_file(resource_dir / "gameboy.bit") as f:
             overlay_path = f.resolve()
         start_time = time.time()
-        self.overlay = Overlay(str(overlay_path))
+        with trace.span("load_overlay"):
+            self.overlay = Overlay(str(overlay_path))
         duration = time.time() - start_time
         logging.info("Finished loading overlay in %f sec", duration)
 
@@ -82,6 +105,9 @@ class Gameboy:
         # Framebuffer for UI
         framebuffer_size = WIDTH * HEIGHT
         self._framebuffer = allocate(shape=(framebuffer_size, ), dtype="uint16")
+        self._overlay_buffer = allocate(shape=(WIDTH * OVERLAY_LINES, ), dtype="uint16")
+
+        threading.Thread(target=self._poll_stats, daemon=True).start()
 
     def _write_reg_control(self) -> None:
         value = 0
@@ -109,8 +135,12 @@ class Gameboy:
         self._reset = True
         self._write_reg_control()
         time.sleep(0.01)
-        self._reset = False
-        self._write_reg_control()
+        with self._stats_lock:
+            # The stat registers are all reset along with the Gameboy.
+            self._reset = False
+            self._write_reg_control()
+            self._stats_total = {name: 0 for name in STAT_REGISTERS}
+            self._stats_last = {name: 0 for name in STAT_REGISTERS}
         self._time_unpaused = time.monotonic()
         self._duration_playing = 0.0
 
@@ -120,19 +150,118 @@ class Gameboy:
         self._registers.write(REGISTER_EMU_CART_CONFIG, 0)
         self._rom_buffer = None
         self._ram_buffer = None
+        self.rom_crc32 = None
+        self.rom_load_time = None
+
+    @trace.traced()
+    def read_rom(
+        self,
+        rom_path: Path,
+        cache: Optional[romfile.ImageCache] = None,
+        rom_data: Optional[bytes] = None,
+        rom_stat: Optional[os.stat_result] = None,
+    ) -> "RomImage":
+        """
+        Read a ROM into a new ROM buffer, without changing the cartridge. Raises RomLoadException if
+        it can't be read.
+
+        If `cache` is given, the ROM is read from its cached image if there is one, and its image is
+        cached otherwise (e.g. to avoid decompressing an archive, or reading slow storage, the next
+        time). If the (decompressed) ROM has already been read, it can be passed in as `rom_data`,
+        along with the `rom_stat` of the ROM file from before it was read so that its image can be
+        cached (or None if it was read from the cache).
+        """
+        start_time = time.monotonic()
+        if rom_data is not None:
+            rom_context = contextlib.nullcontext((io.BytesIO(rom_data), len(rom_data)))
+            rom = self._read_rom(rom_path, rom_context, start_time)
+            if cache is not None and rom_stat is not None:
+                self._cache_image(cache, rom_stat, rom)
+            return rom
+
+        if cache is not None:
+            image = cache.lookup(rom_path)
+            if image is not None:
+                try:
+                    rom = self._read_rom(rom_path, romfile.open_rom(image.path), start_time)
+                except RomLoadException as e:
+                    logging.warning("Could not read cached image of %s: %s", rom_path, e)
+                else:
+                    if rom.crc32 == image.crc32:
+                        return rom
+                    logging.warning("Cached image of %s is corrupt", rom_path)
+                cache.discard(image)
+
+        try:
+            stat = rom_path.stat()
+        except OSError as e:
+            raise RomLoadException(f"Could not read ROM: {e}")
+        rom = self._read_rom(rom_path, romfile.open_rom(rom_path), start_time)
+        if cache is not None:
+            self._cache_image(cache, stat, rom)
+        return rom
+
+    def _cache_image(self, cache: romfile.ImageCache, stat: os.stat_result, rom: "RomImage") -> None:
+        # Write the image in the background, so it doesn't delay the launch.
+        threading.Thread(
+            target=cache.store, args=(rom.path, stat, rom.buffer.tobytes(), rom.crc32), daemon=True
+        ).start()
+
+    def _read_rom(self, rom_path: Path, rom_context, start_time: float) -> "RomImage":
+        try:
+            with rom_context as (stream, rom_size):
+                # Parse ROM header
+                logging.info("Parsing ROM header...")
+                header_data = stream.read(romfile.HEADER_SIZE)
+                header = RomHeader(header_data)
+                if rom_size is None:
+                    rom_size = header.rom_size
+
+                # Decompress (or read) the rest straight into the ROM buffer.
+                buffer = allocate(shape=(rom_size, ), dtype="uint8")
+                buffer[:len(header_data)] = np.frombuffer(header_data, dtype=np.uint8)
+                body_read, crc32 = romfile.read_into(stream, buffer[len(header_data):], zlib.crc32(header_data))
+                bytes_read = len(header_data) + body_read
+        except romfile.ROM_READ_ERRORS as e:
+            raise RomLoadException(f"Could not read ROM: {e}")
+        if bytes_read != rom_size:
+            raise RomLoadException("ROM file is truncated")
+        buffer.sync_to_device()
+        return RomImage(rom_path, header, buffer, crc32, time.monotonic() - start_time)
+
+    def set_emulated_cartridge(
+        self,
+        rom_path: Path,
+        cache: Optional[romfile.ImageCache] = None,
+        rom_data: Optional[bytes] = None,
+        save_data: Optional[bytes] = None,
+    ) -> None:
+        """
+        Sets the use of an enumated cartridge, reading the ROM with `read_rom`.
+
+        If the save file has already been read, it can be passed in as `save_data`.
+        """
+        self.set_emulated_rom(self.read_rom(rom_path, cache, rom_data=rom_data), save_data)
+
+    @trace.traced()
+    def set_emulated_rom(self, rom: "RomImage", save_data: Optional[bytes] = None) -> None:
+        """Sets the use of an emulated cartridge, with a ROM from `read_rom`."""
+        start_time = time.monotonic()
+        # Read the save file (if one exists) before anything is changed, in case it can't be read.
+        save_path = romfile.save_path(rom.path)
+        if save_data is None and save_path.is_file():
+            try:
+                save_data = save_path.read_bytes()
+            except OSError as e:
+                raise RomLoadException(f"Could not read save file: {e}")
 
-    def set_emulated_cartridge(self, rom_path: Path) -> None:
-        """Sets the use of an enumated cartridge"""
         self._emu_cartridge = True
-        rom_data = np.fromfile(open(rom_path, "rb"), dtype=np.uint8)
-        rom_size = rom_data.shape[0]
-        self._rom_buffer = allocate(shape=rom_data.shape, dtype="uint8")
-        self._rom_buffer[:] = rom_data
-        self._rom_buffer.sync_to_device()
-
-        # Parse ROM header
-        logging.info("Parsing ROM header...")
-        self.rom_header = RomHeader(rom_data)
+        self._save_path = save_path
+        self.rom_header = rom.header
+        self._rom_buffer = rom.buffer
+        self.rom_crc32 = rom.crc32
+        rom_size = len(rom.buffer)
+
         logging.info(f"Cart type: {self.rom_header.cartridge_type}")
         logging.info(f"Ram? {self.rom_header.has_ram}  Rtc? {self.rom_header.has_rtc}  Rumble? {self.rom_header.has_rumble}")
         logging.info(f"ROM size: {self.rom_header.rom_size}")
@@ -146,9 +275,8 @@ class Gameboy:
             self._ram_buffer.fill(0xFF)
 
         # Load save file, if one exists.
-        self._save_path = rom_path.with_suffix(".sav")
-        if self._save_path.is_file():
-            save_data = np.fromfile(self._save_path, dtype="uint8")
+        if save_data is not None:
+            save_data = np.frombuffer(save_data, dtype="uint8")
             if self._ram_buffer is not None:
                 self._ram_buffer[:] = save_data[:self.rom_header.ram_size]
                 logging.info("Loaded save file at %s", self._save_path)
@@ -174,7 +302,9 @@ class Gameboy:
         else:
             self._registers.write(REGISTER_RAM_ADDRESS, 0)
             self._registers.write(REGISTER_RAM_MASK, 0)
+        self.rom_load_time = rom.load_time + (time.monotonic() - start_time)
 
+    @trace.traced()
     def persist_ram(self) -> None:
         """Persists battery-backed ram (if present) to disk."""
         if not self._emu_cartridge:
@@ -207,37 +337,94 @@ class Gameboy:
         if button in self._joypad:
             self._joypad[button].write(int(pressed))
 
+    @trace.traced()
     def _wait_for_blit_complete(self) -> None:
-        if self._blit_active:
-            while self._registers.read(REGISTER_BLIT_CONTROL) != 0:
-                time.sleep(0.01)
+        with self._blit_lock:
+            if self._blit_active:
+                while self._registers.read(REGISTER_BLIT_CONTROL) != 0:
+                    time.sleep(0.01)
 
-        self._blit_active = False
+            self._blit_active = False
 
-    def copy_framebuffer(self, image: Image) -> None:
+    @trace.traced()
+    def copy_framebuffer(self, frame: np.ndarray) -> None:
         """
-        Copy an image to the PL framebuffer.
+        Copy a frame to the PL framebuffer.
         
-        Image should be 160x144, mode 'I', where the lower 16-bits are interpreted as:
+        Frame should be a 144x160 uint16 array, where each pixel is interpreted as:
         a bbbbb ggggg rrrrr
 
         a is transparency -- 1 for opaque, 0 for transparent
         """
-        self._wait_for_blit_complete()
-        self.set_paused(True)
-        np.copyto(self._framebuffer, np.array(image).view(np.uint16).flatten()[0::2])
-        self._registers.write(REGISTER_BLIT_ADDRESS, self._framebuffer.device_address)
-        self._registers.write(REGISTER_BLIT_CONTROL, 1)
-        self._blit_active = True
+        with self._blit_lock:
+            self._wait_for_blit_complete()
+            self.set_paused(True)
+            np.copyto(self._framebuffer, frame.reshape(-1))
+            self._registers.write(REGISTER_BLIT_ADDRESS, self._framebuffer.device_address)
+            self._registers.write(REGISTER_BLIT_CONTROL, 1)
+            self._blit_active = True
+
+    @trace.traced()
+    def copy_overlay(self, frame: np.ndarray) -> None:
+        """
+        Copy a frame to the PL overlay, without pausing the Gameboy.
+
+        Frame should be a 10x160 (OVERLAY_LINES x WIDTH) uint16 array, in the same format as for
+        `copy_framebuffer`.
+        """
+        with self._blit_lock:
+            self._wait_for_blit_complete()
+            np.copyto(self._overlay_buffer, frame.reshape(-1))
+            self._registers.write(REGISTER_BLIT_ADDRESS, self._overlay_buffer.device_address)
+            # Bit 1: blit to the overlay rather than the framebuffer
+            self._registers.write(REGISTER_BLIT_CONTROL, 0b11)
+            self._blit_active = True
+
+    def set_overlay(self, enabled: bool, line: int = 0) -> None:
+        """Show or hide the overlay, covering the screen from the given line."""
+        self._registers.write(REGISTER_OVERLAY_CONTROL, (line << 1) | int(enabled))
+
+    def _read_stat(self, name: str) -> int:
+        # Must hold _stats_lock
+        value = self._registers.read(STAT_REGISTERS[name])
+        self._stats_total[name] += (value - self._stats_last[name]) & 0xFFFFFFFF
+        self._stats_last[name] = value
+        return self._stats_total[name]
+
+    def _poll_stats(self) -> None:
+        while True:
+            time.sleep(self.STATS_POLL_INTERVAL)
+            self.get_stats()
 
     def get_stats(self) -> Dict[str, int]:
+        """Get the stat counters since the last reset."""
+        with self._stats_lock:
+            return {name: self._read_stat(name) for name in STAT_REGISTERS}
+    
+    def get_debug(self) -> Dict[str, int]:
+        """Get the CPU registers, and the raw serial debug register."""
+        cpu1 = self._registers.read(REGISTER_DEBUG_CPU1)
+        cpu2 = self._registers.read(REGISTER_DEBUG_CPU2)
+        cpu3 = self._registers.read(REGISTER_DEBUG_CPU3)
         return {
-            "stalls": self._registers.read(REGISTER_STAT_STALLS),
-            "clocks": self._registers.read(REGISTER_STAT_CLOCKS),
-            "cache_hits": self._registers.read(REGISTER_STAT_CACHE_HITS),
-            "cache_misses": self._registers.read(REGISTER_STAT_CACHE_MISSES),
+            "b": (cpu1 >> 24) & 0xFF,
+            "c": (cpu1 >> 16) & 0xFF,
+            "d": (cpu1 >> 8) & 0xFF,
+            "e": cpu1 & 0xFF,
+            "h": (cpu2 >> 24) & 0xFF,
+            "l": (cpu2 >> 16) & 0xFF,
+            "f": (cpu2 >> 8) & 0xFF,
+            "a": cpu2 & 0xFF,
+            "sp": (cpu3 >> 16) & 0xFFFF,
+            "pc": cpu3 & 0xFFFF,
+            "serial": self._registers.read(REGISTER_DEBUG_SERIAL),
         }
-    
+
+    def get_clocks(self) -> int:
+        """Get the number of emulated clocks since the last reset."""
+        with self._stats_lock:
+            return self._read_stat("clocks")
+
     def get_playtime(self) -> float:
         """Get the time (in seconds) the Game Boy has been playing since the last reset."""
         if self._paused:
@@ -246,8 +433,22 @@ class Gameboy:
             return self._duration_playing + (time.monotonic() - self._time_unpaused)
 
 
+class RomImage:
+    """A ROM read into a ROM buffer, ready to be used as the emulated cartridge."""
+
+    def __init__(self, path: Path, header: "RomHeader", buffer: np.ndarray, crc32: int, load_time: float) -> None:
+        self.path = path
+        self.header = header
+        self.buffer = buffer
+        self.crc32 = crc32
+        # Seconds taken to read the ROM
+        self.load_time = load_time
+
+
 class RomHeader:
     def __init__(self, rom_data: bytes) -> None:
+        if len(rom_data) < romfile.HEADER_SIZE:
+            raise RomLoadException("ROM file is too small")
         self.mbc = 0
         self.has_ram = False
         self.has_rtc = False
@@ -281,6 +482,8 @@ class RomHeader:
         self.ram_size = {0: 0, 2: (8 * 1024), 3: (32 * 1024), 4: (128 * 1024), 5: (64 * 1024)}[rom_data[0x149]]
         if self.mbc == 2:
             self.ram_size = 512
+        self.global_checksum = (rom_data[0x14E] << 8) | rom_data[0x14F]
+        self.title = romfile.header_title(rom_data)
 
     def get_emu_cart_config(self) -> int:
         value = 1  # Lowest bit: is emulated cartridge enabled
@@ -291,10 +494,6 @@ class RomHeader:
         return value
 
 
-class RomLoadException(Exception):
-    pass
-
-
 class RtcState:
     seconds: int
     minutes: int
@@ -0,0 +1,161 @@
+"""
+Per-ROM performance history: a summary of every play session of an emulated cartridge.
+
+Summaries are appended to a file of fixed-size records in the ROM directory, keyed by the CRC32 of the
+ROM image (so renamed or recompressed ROMs share their history). The file is read once at startup, and
+per-ROM totals are kept in memory, so queries don't touch the disk.
+"""
+
+import logging
+import os
+from pathlib import Path
+import struct
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+# crc32, timestamp, title, playtime, clocks, stalls, cache hits, cache misses, load time
+_RECORD = struct.Struct("<IQ16sdQQQQd")
+
+
+class SessionSummary(NamedTuple):
+    crc32: int
+    timestamp: int
+    title: str
+    # Seconds of (unpaused) play
+    playtime: float
+    clocks: int
+    stalls: int
+    cache_hits: int
+    cache_misses: int
+    # Seconds to load the ROM
+    load_time: float
+
+    def pack(self) -> bytes:
+        title = self.title.encode("ascii", errors="replace")[:16]
+        return _RECORD.pack(
+            self.crc32, self.timestamp, title, self.playtime, self.clocks, self.stalls,
+            self.cache_hits, self.cache_misses, self.load_time,
+        )
+
+    @staticmethod
+    def unpack(data: bytes, offset: int = 0) -> "SessionSummary":
+        fields = list(_RECORD.unpack_from(data, offset))
+        fields[2] = fields[2].rstrip(b"\0").decode("ascii", errors="replace")
+        return SessionSummary(*fields)
+
+
+class RomHistory:
+    """Totals over all of the play sessions of a ROM."""
+
+    def __init__(self, crc32: int, title: str) -> None:
+        self.crc32 = crc32
+        self.title = title
+        self.sessions = 0
+        self.last_played = 0
+        self.playtime = 0.0
+        self.clocks = 0
+        self.stalls = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.total_load_time = 0.0
+
+    def add(self, summary: SessionSummary) -> None:
+        self.title = summary.title
+        self.sessions += 1
+        self.last_played = max(self.last_played, summary.timestamp)
+        self.playtime += summary.playtime
+        self.clocks += summary.clocks
+        self.stalls += summary.stalls
+        self.cache_hits += summary.cache_hits
+        self.cache_misses += summary.cache_misses
+        self.total_load_time += summary.load_time
+
+    @property
+    def stall_rate(self) -> float:
+        """Fraction of the time that the Game Boy was stalled waiting on the cartridge."""
+        return self.stalls / (self.clocks + self.stalls + 1)
+
+    @property
+    def hit_rate(self) -> float:
+        return self.cache_hits / (self.cache_hits + self.cache_misses + 1)
+
+    @property
+    def load_time(self) -> float:
+        """Average load time, in seconds."""
+        return self.total_load_time / max(self.sessions, 1)
+
+
+class History:
+    FILENAME = ".gameboy_ps_history.bin"
+    # Sessions shorter than this (in seconds of play) aren't worth recording.
+    MIN_PLAYTIME = 1.0
+
+    def __init__(self, rom_directory: Path) -> None:
+        self.path = rom_directory / self.FILENAME
+        self._roms: Dict[int, RomHistory] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            data = self.path.read_bytes()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logging.warning("Could not read performance history: %s", e)
+            return
+        count = len(data) // _RECORD.size
+        for i in range(count):
+            self._add(SessionSummary.unpack(data, i * _RECORD.size))
+        if len(data) != count * _RECORD.size:
+            # Drop a partial record at the end (from an interrupted write), so new records stay aligned.
+            logging.warning("Dropping partial record at the end of %s", self.path)
+            try:
+                os.truncate(self.path, count * _RECORD.size)
+            except OSError as e:
+                logging.warning("Could not truncate performance history: %s", e)
+
+    def _add(self, summary: SessionSummary) -> None:
+        rom = self._roms.get(summary.crc32)
+        if rom is None:
+            rom = self._roms[summary.crc32] = RomHistory(summary.crc32, summary.title)
+        rom.add(summary)
+
+    def append(self, summary: SessionSummary) -> None:
+        if summary.playtime < self.MIN_PLAYTIME:
+            return
+        with self._lock:
+            self._add(summary)
+            try:
+                with open(self.path, "ab") as f:
+                    f.write(summary.pack())
+            except OSError as e:
+                logging.warning("Could not write performance history: %s", e)
+
+    def get(self, crc32: int) -> Optional[RomHistory]:
+        with self._lock:
+            return self._roms.get(crc32)
+
+    def worst(self, count: int) -> List[RomHistory]:
+        """The ROMs with the highest stall rates."""
+        with self._lock:
+            roms = list(self._roms.values())
+        return sorted(roms, key=lambda rom: rom.stall_rate, reverse=True)[:count]
+
+    def record_session(self, gameboy: "Gameboy") -> None:
+        """Append a summary of the play session of the loaded emulated cartridge, since its last reset."""
+        if gameboy.rom_crc32 is None:
+            return
+        stats = gameboy.get_stats()
+        self.append(SessionSummary(
+            crc32=gameboy.rom_crc32,
+            timestamp=int(time.time()),
+            title=gameboy.rom_header.title,
+            playtime=gameboy.get_playtime(),
+            clocks=stats["clocks"],
+            stalls=stats["stalls"],
+            cache_hits=stats["cache_hits"],
+            cache_misses=stats["cache_misses"],
+            load_time=gameboy.rom_load_time or 0.0,
+        ))
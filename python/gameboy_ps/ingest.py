@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+"""
+Checks a ROM library: hashes every ROM, validates its header, and finds duplicates and bad dumps.
+
+Run from the `python` directory (Pynq isn't needed):
+
+    python -m gameboy_ps.ingest <path to ROM directory> [--dat PATH] [--dedupe] [--jobs N] [--json PATH]
+
+ROMs are hashed (CRC32 and SHA-1 of the decompressed image) in a pool of processes. The results are
+cached in the ROM directory by file size and modification time, so only new or changed files are
+hashed again. The exit status is 1 if any problems were found.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import itertools
+import json
+import logging
+import os
+from pathlib import Path
+import sys
+from typing import Any, Dict, List, NamedTuple, Optional
+import xml.etree.ElementTree as ElementTree
+import zlib
+
+from . import romfile
+
+CACHE_FILENAME = ".gameboy_ps_hashes.json"
+DUPLICATES_DIRECTORY = "duplicates"
+
+
+class RomInfo(NamedTuple):
+    path: str
+    size: int
+    crc32: int
+    sha1: str
+    title: str
+    # ROM size according to the header (byte 0x148), or None if the code is invalid
+    header_rom_size: Optional[int]
+    header_checksum_ok: bool
+    global_checksum_ok: bool
+
+
+def scan(path: Path) -> RomInfo:
+    """Hash and validate a ROM file (or archive). Runs in a worker process."""
+    crc = 0
+    sha1 = hashlib.sha1()
+    # Sum of all bytes except the global checksum itself (at 0x14E and 0x14F).
+    byte_sum = 0
+    size = 0
+    header = b""
+    with romfile.open_rom(path) as (stream, _):
+        while chunk := stream.read(romfile.CHUNK_SIZE):
+            crc = zlib.crc32(chunk, crc)
+            sha1.update(chunk)
+            byte_sum += sum(chunk)
+            if len(header) < romfile.HEADER_SIZE:
+                header += chunk[:(romfile.HEADER_SIZE - len(header))]
+            size += len(chunk)
+
+    if len(header) < romfile.HEADER_SIZE:
+        return RomInfo(str(path), size, crc, sha1.hexdigest(), "", None, False, False)
+
+    # Same as the ROM size computed by `RomHeader`; anything beyond 8 MiB isn't a valid code.
+    header_rom_size = 32 * 1024 * (1 << header[0x148]) if header[0x148] <= 8 else None
+    header_checksum = 0
+    for value in header[0x134:0x14D]:
+        header_checksum = (header_checksum - value - 1) & 0xFF
+    global_checksum = (header[0x14E] << 8) | header[0x14F]
+    byte_sum = (byte_sum - header[0x14E] - header[0x14F]) & 0xFFFF
+    return RomInfo(
+        path=str(path),
+        size=size,
+        crc32=crc,
+        sha1=sha1.hexdigest(),
+        title=romfile.header_title(header),
+        header_rom_size=header_rom_size,
+        header_checksum_ok=header_checksum == header[0x14D],
+        global_checksum_ok=byte_sum == global_checksum,
+    )
+
+
+def _scan_or_error(path: Path) -> Any:
+    try:
+        return scan(path)
+    except romfile.ROM_READ_ERRORS as e:
+        return f"{type(e).__name__}: {e}"
+
+
+def load_dat(path: Path) -> Dict[str, str]:
+    """Read a Logiqx XML DAT file (as used by No-Intro), mapping the SHA-1 of each ROM to its game name."""
+    games = {}
+    for game in ElementTree.parse(path).getroot().iter("game"):
+        for rom in game.iter("rom"):
+            sha1 = rom.get("sha1")
+            if sha1 is not None:
+                games[sha1.lower()] = game.get("name", rom.get("name", ""))
+    return games
+
+
+class Library:
+    def __init__(self, rom_directory: Path) -> None:
+        self.rom_directory = rom_directory
+        self.cache_path = rom_directory / CACHE_FILENAME
+        self.roms: List[RomInfo] = []
+        # Files that couldn't be read, with the error
+        self.errors: Dict[Path, str] = {}
+
+    def _load_cache(self) -> Dict[str, Any]:
+        try:
+            return json.loads(self.cache_path.read_text())
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning("Could not read hash cache: %s", e)
+            return {}
+
+    def _save_cache(self, cache: Dict[str, Any]) -> None:
+        temp_path = self.cache_path.with_suffix(".tmp")
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(cache, f)
+            os.replace(temp_path, self.cache_path)
+        except OSError as e:
+            logging.warning("Could not write hash cache: %s", e)
+
+    def scan(self, jobs: Optional[int] = None) -> None:
+        """Hash all of the ROMs in the library, reusing cached hashes of unchanged files."""
+        cache = self._load_cache()
+        new_cache = {}
+        pending = []
+        for path in romfile.list_roms(self.rom_directory):
+            stat = path.stat()
+            key = path.name
+            entry = cache.get(key)
+            if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                self.roms.append(RomInfo(**dict(entry["info"], path=str(path))))
+                new_cache[key] = entry
+            else:
+                pending.append((path, stat))
+
+        if pending:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                # Small chunks keep all the workers busy even if a few ROMs are much bigger than the rest.
+                results = executor.map(_scan_or_error, [path for (path, _) in pending], chunksize=4)
+                for ((path, stat), result) in zip(pending, results):
+                    if isinstance(result, str):
+                        self.errors[path] = result
+                        continue
+                    self.roms.append(result)
+                    new_cache[path.name] = {
+                        "size": stat.st_size,
+                        "mtime_ns": stat.st_mtime_ns,
+                        "info": result._asdict(),
+                    }
+        self.roms.sort(key=lambda rom: rom.path)
+        self._save_cache(new_cache)
+
+    def duplicates(self) -> List[List[RomInfo]]:
+        """Groups of ROMs with identical contents. The first of each group is the one to keep."""
+        groups: Dict[str, List[RomInfo]] = {}
+        for rom in self.roms:
+            groups.setdefault(rom.sha1, []).append(rom)
+        # Prefer keeping raw ROMs (which load fastest), then the shortest name.
+        return [
+            sorted(group, key=lambda rom: (romfile.is_archive(Path(rom.path)), len(rom.path), rom.path))
+            for group in groups.values()
+            if len(group) > 1
+        ]
+
+    def problems(self, dat: Optional[Dict[str, str]] = None) -> Dict[str, List[str]]:
+        """Problems with each ROM, by path."""
+        problems: Dict[str, List[str]] = {str(path): [error] for (path, error) in self.errors.items()}
+        for rom in self.roms:
+            messages = []
+            if rom.header_rom_size is None:
+                messages.append("Invalid ROM size code in header")
+            elif rom.size != rom.header_rom_size:
+                # The ROM is mapped using `rom_size - 1` as the address mask, so the sizes must agree.
+                messages.append(f"Size is {rom.size} bytes, but the header says {rom.header_rom_size} bytes")
+            if rom.size & (rom.size - 1):
+                messages.append(f"Size {rom.size} is not a power of two")
+            if not rom.header_checksum_ok:
+                messages.append("Bad header checksum")
+            if not rom.global_checksum_ok:
+                messages.append("Bad global checksum")
+            if dat is not None and rom.sha1 not in dat:
+                messages.append("Not in DAT file (bad dump or hack?)")
+            if messages:
+                problems[rom.path] = messages
+        return problems
+
+    def dedupe(self) -> int:
+        """Move all but one of each group of duplicates to a subdirectory. Returns the number of files moved."""
+        destination = self.rom_directory / DUPLICATES_DIRECTORY
+        moved = 0
+        for group in self.duplicates():
+            kept_save_path = romfile.save_path(Path(group[0].path))
+            for rom in group[1:]:
+                destination.mkdir(exist_ok=True)
+                path = Path(rom.path)
+                new_path = _unique_path(destination / path.name)
+                save_path = romfile.save_path(path)
+                # Archived and raw copies of a ROM can share a save file, which stays with the kept copy.
+                if save_path.is_file() and save_path != kept_save_path:
+                    new_save_path = romfile.save_path(new_path)
+                    if new_save_path.exists():
+                        logging.warning("Not moving %s: %s already exists", path, new_save_path)
+                        continue
+                    logging.warning("Moving save file %s along with its ROM", save_path)
+                    save_path.rename(new_save_path)
+                path.rename(new_path)
+                moved += 1
+        return moved
+
+
+def _unique_path(path: Path) -> Path:
+    """The path, or if it already exists, the path with a number added to the name."""
+    # Number the name before its suffixes, so that it still looks like a ROM (e.g. "Game (1).gb.gz").
+    suffix = "".join(path.suffixes[-2:]) if path.suffix.lower() in (".gz", ".xz") else path.suffix
+    stem = path.name[:(len(path.name) - len(suffix))]
+    for i in itertools.count(1):
+        if not path.exists():
+            return path
+        path = path.with_name(f"{stem} ({i}){suffix}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m gameboy_ps.ingest", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("rom_directory", type=Path)
+    parser.add_argument("--dat", type=Path, help="DAT file (Logiqx XML) of known good dumps to check against")
+    parser.add_argument(
+        "--dedupe", action="store_true",
+        help=f"move duplicates into a '{DUPLICATES_DIRECTORY}' subdirectory, keeping one copy of each ROM",
+    )
+    parser.add_argument("--jobs", type=int, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--json", type=Path, help="write the hashes and problems to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='[%(levelname)s] %(message)s', level=logging.INFO)
+
+    dat = load_dat(args.dat) if args.dat is not None else None
+    library = Library(args.rom_directory)
+    library.scan(args.jobs)
+    problems = library.problems(dat)
+    duplicates = library.duplicates()
+
+    for (path, messages) in sorted(problems.items()):
+        for message in messages:
+            print(f"{path}: {message}")
+    for group in duplicates:
+        names = ", ".join(Path(rom.path).name for rom in group[1:])
+        print(f"{group[0].path}: Duplicated by {names}")
+    print(f"{len(library.roms)} ROMs, {len(problems)} with problems, {len(duplicates)} duplicated")
+
+    if args.dedupe:
+        print(f"Moved {library.dedupe()} duplicates to {args.rom_directory / DUPLICATES_DIRECTORY}")
+
+    if args.json is not None:
+        output = {
+            "roms": [
+                dict(rom._asdict(), dat_name=dat.get(rom.sha1) if dat is not None else None)
+                for rom in library.roms
+            ],
+            "problems": problems,
+            "duplicates": [[rom.path for rom in group] for group in duplicates],
+        }
+        args.json.write_text(json.dumps(output, indent=2) + "\n")
+
+    return 1 if problems or (duplicates and not args.dedupe) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+ROM library spread over the ROM directory and (optionally) slower library roots, e.g. USB drives or
+network mounts. Images of ROMs from the slow roots are kept on fast local storage by the
+`romfile.ImageCache`.
+
+This module must not depend on Pynq, so that the last game can be read while Pynq is still loading.
+"""
+
+import logging
+from pathlib import Path
+import threading
+from typing import List, Optional, Sequence
+
+from . import romfile
+
+# Seconds to wait for the first listing of the slow roots
+LIST_TIMEOUT = 2.0
+
+
+class RomLibrary:
+    """
+    The ROMs in the ROM directory, and in any slower library roots.
+
+    Listings of the slow roots are kept in memory and refreshed in the background.
+    """
+
+    def __init__(self, rom_directory: Path, slow_roots: Sequence[Path] = ()) -> None:
+        self.rom_directory = rom_directory
+        self.slow_roots = list(slow_roots)
+        self._slow_roms: List[Path] = []
+        self._refresh_lock = threading.Lock()
+        self._refresh_thread: Optional[threading.Thread] = None
+        # Set once the slow roots have been listed
+        self._listed = threading.Event()
+        if self.slow_roots:
+            self.refresh()
+
+    @property
+    def roots(self) -> List[Path]:
+        return [self.rom_directory] + self.slow_roots
+
+    def refresh(self) -> None:
+        """List the slow roots again, in the background."""
+        with self._refresh_lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(target=self._refresh, daemon=True)
+            self._refresh_thread.start()
+
+    def _refresh(self) -> None:
+        roms = []
+        for root in self.slow_roots:
+            try:
+                roms += romfile.list_roms(root)
+            except OSError as e:
+                logging.warning("Could not list ROMs in %s: %s", root, e)
+            if not self._listed.is_set():
+                # Until the first listing is complete, show the roots listed so far.
+                self._slow_roms = list(roms)
+        self._slow_roms = roms
+        self._listed.set()
+
+    @property
+    def scanning(self) -> bool:
+        """Whether the slow roots are still being listed for the first time."""
+        return not self._listed.is_set()
+
+    def list_roms(self, timeout: float = LIST_TIMEOUT) -> List[Path]:
+        """
+        List the ROM files and archives in all of the roots.
+
+        The slow roots are listed as of the last refresh, and are refreshed in the background for the
+        next time. The first refresh is waited for for up to `timeout` seconds (e.g. in case a mount
+        hangs); after that, only the slow roots listed so far are included (see `scanning`).
+        """
+        if self.slow_roots:
+            self._listed.wait(timeout)
+            self.refresh()
+        return romfile.list_roms(self.rom_directory) + self._slow_roms
+
+    def _root_of(self, rom_path: Path) -> Optional[Path]:
+        for root in self.roots:
+            if rom_path.is_relative_to(root):
+                return root
+        return None
+
+    def name(self, rom_path: Path) -> str:
+        """Name of the ROM, relative to its root."""
+        root = self._root_of(rom_path)
+        return str(rom_path.relative_to(root)) if root is not None else str(rom_path)
+
+    def find(self, name: str) -> Optional[Path]:
+        """Find a ROM by its name (relative to its root)."""
+        for rom_path in self.list_roms():
+            if self.name(rom_path) == name:
+                return rom_path
+        return None
+
+    def is_slow(self, rom_path: Path) -> bool:
+        root = self._root_of(rom_path)
+        return root is not None and root != self.rom_directory
+
+    def should_cache(self, rom_path: Path) -> bool:
+        """
+        Whether the ROM should be loaded through the image cache: ROMs from slow roots, so they load
+        at local speed, and archives, so they only need to be decompressed once.
+        """
+        return self.is_slow(rom_path) or romfile.is_archive(rom_path)
@@ -0,0 +1,139 @@
+"""
+Recording and replaying of joypad input, so that a play session can be used as a repeatable benchmark.
+
+Events are timestamped in emulated clocks since the last reset, so a replay presses the buttons at the
+same point in the game regardless of pauses and cartridge stalls.
+"""
+
+import json
+import logging
+from pathlib import Path
+import struct
+import threading
+import time
+from typing import List, NamedTuple
+
+from .controller import Button
+from . import romfile
+
+MAGIC = b"GBIN"
+VERSION = 1
+# magic, version, ROM global checksum, end clock
+_HEADER = struct.Struct("<4sBHQ")
+# clock, button | (pressed << 7)
+_EVENT = struct.Struct("<QB")
+
+
+class InputEvent(NamedTuple):
+    clock: int
+    button: Button
+    pressed: bool
+
+
+class InputRecording:
+    def __init__(self, rom_checksum: int) -> None:
+        self.rom_checksum = rom_checksum
+        self.events: List[InputEvent] = []
+        # Clock at which the recording was stopped
+        self.end_clock = 0
+
+    @staticmethod
+    def load(path: Path) -> "InputRecording":
+        data = path.read_bytes()
+        magic, version, rom_checksum, end_clock = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not an input recording: {path}")
+        recording = InputRecording(rom_checksum)
+        recording.end_clock = end_clock
+        for (clock, value) in _EVENT.iter_unpack(data[_HEADER.size:]):
+            recording.events.append(InputEvent(clock, Button(value & 0x7F), bool(value >> 7)))
+        return recording
+
+    def save(self, path: Path) -> None:
+        with open(path, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, self.rom_checksum, self.end_clock))
+            for event in self.events:
+                f.write(_EVENT.pack(event.clock, event.button.value | (int(event.pressed) << 7)))
+
+
+def recording_path(rom_path: Path) -> Path:
+    return romfile.save_path(rom_path).with_suffix(".inputs")
+
+
+def results_path(rom_path: Path) -> Path:
+    return romfile.save_path(rom_path).with_suffix(".replays.jsonl")
+
+
+class Recorder:
+    """Records joypad input from the last reset, until stopped."""
+
+    def __init__(self, gameboy: "Gameboy", rom_path: Path) -> None:
+        self._gameboy = gameboy
+        self._path = recording_path(rom_path)
+        self._recording = InputRecording(gameboy.rom_header.global_checksum)
+        self._lock = threading.Lock()
+        logging.info("Recording input to %s", self._path)
+
+    def on_button(self, button: Button, pressed: bool) -> None:
+        if button == Button.HOME:
+            return
+        with self._lock:
+            self._recording.events.append(InputEvent(self._gameboy.get_clocks(), button, pressed))
+
+    def stop(self) -> None:
+        with self._lock:
+            self._recording.end_clock = self._gameboy.get_clocks()
+            self._recording.save(self._path)
+        logging.info("Saved %d input events to %s", len(self._recording.events), self._path)
+
+
+class Replayer:
+    """Replays recorded joypad input from the last reset, then records the stats at the end of the recording."""
+    # Shortest time to sleep between polls of the clock counter.
+    SPIN_INTERVAL = 0.0005
+    # Longest time to sleep between polls of the clock counter (e.g. while paused).
+    MAX_POLL_INTERVAL = 0.1
+
+    def __init__(self, gameboy: "Gameboy", rom_path: Path) -> None:
+        self._gameboy = gameboy
+        self._path = recording_path(rom_path)
+        self._results_path = results_path(rom_path)
+        self._recording = InputRecording.load(self._path)
+        if self._recording.rom_checksum != gameboy.rom_header.global_checksum:
+            logging.warning("Input recording %s was made with a different ROM", self._path)
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logging.info("Replaying %d input events from %s", len(self._recording.events), self._path)
+
+    def _wait_until(self, clock: int) -> bool:
+        """Wait until the given clock. Returns false if stopped before then."""
+        while not self._stop_event.is_set():
+            now = self._gameboy.get_clocks()
+            if now >= clock:
+                return True
+            # Sleep until shortly before the target, then poll.
+            remaining = (clock - now) / self._gameboy.CLOCK_RATE
+            time.sleep(min(max(remaining - 0.002, self.SPIN_INTERVAL), self.MAX_POLL_INTERVAL))
+        return False
+
+    def _run(self) -> None:
+        for event in self._recording.events:
+            if not self._wait_until(event.clock):
+                return
+            self._gameboy.set_button(event.button, event.pressed)
+        if not self._wait_until(self._recording.end_clock):
+            return
+
+        result = self._gameboy.get_stats()
+        result["playtime"] = self._gameboy.get_playtime()
+        result["timestamp"] = int(time.time())
+        logging.info("Finished replay: %s", result)
+        with open(self._results_path, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._thread.join()
+        for button in Button:
+            self._gameboy.set_button(button, False)
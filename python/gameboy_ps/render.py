@@ -0,0 +1,331 @@
+"""
+Optional render process, which runs the UI in its own process so that rendering doesn't hold up the
+controllers and register I/O in the main process (which owns the hardware).
+
+The UI talks to the main process through `RemoteSystem`, a proxy for the `System`: attribute reads
+and writes and method calls are forwarded over a pipe. Frames are drawn into a `SharedFramebuffer`,
+and only their sequence numbers are sent.
+
+If tracing is enabled, it is enabled in the render process too, and its spans are written out with
+the main process's.
+"""
+
+from enum import Enum
+import logging
+import multiprocessing
+from pathlib import Path, PurePath
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .controller import Button
+from .framebuffer import SharedFramebuffer
+from . import library, trace, ui
+
+# Attribute values that are sent to the render process as they are. Any other objects are proxied.
+_VALUE_TYPES = (type(None), bool, int, float, str, bytes, Enum, PurePath, list, tuple, dict)
+
+
+class RenderProcess:
+    """Runs the UI in a render process. Stands in for the `UI` in the main process."""
+
+    def __init__(self, system: "System") -> None:
+        self.system = system
+        self.framebuffer = SharedFramebuffer()
+        context = multiprocessing.get_context("spawn")
+        # Requests from the UI to the system, and events from the system to the UI.
+        self._requests, remote_requests = context.Pipe()
+        self._events, remote_events = context.Pipe()
+        self._events_lock = threading.Lock()
+        # Frame slots (and the overlay) are released once they have been copied to the PL.
+        self._free_frames = context.Semaphore(SharedFramebuffer.FRAME_SLOTS)
+        self._free_overlay = context.Semaphore(1)
+        # UI in this process, if the render process has died
+        self._fallback: Optional[ui.UI] = None
+        self._stopping = False
+
+        threading.Thread(target=self._serve, daemon=True).start()
+        self._process = context.Process(
+            target=_run,
+            args=(
+                remote_requests,
+                remote_events,
+                self.framebuffer.name,
+                self._free_frames,
+                self._free_overlay,
+                system.library.rom_directory,
+                system.library.slow_roots,
+                trace.is_enabled(),
+            ),
+            name="render",
+            daemon=True,
+        )
+        self._process.start()
+        # Only the render process holds its ends of the pipes, so that they close if it dies.
+        remote_requests.close()
+        remote_events.close()
+        logging.info("Started render process (pid %d)", self._process.pid)
+
+    def stop(self) -> None:
+        self._stopping = True
+        if self._fallback is not None:
+            self._fallback.hud.stop()
+        self._process.terminate()
+        self._process.join()
+        self.framebuffer.close(unlink=True)
+
+    def on_button_state(self, button: Button, pressed: bool) -> None:
+        if self._fallback is None:
+            try:
+                with self._events_lock:
+                    self._events.send(("button", button, pressed))
+                return
+            except OSError:
+                self._fall_back()
+        self._fallback.on_button_state(button, pressed)
+
+    def start_cartridge(self) -> None:
+        self._call_ui("start_cartridge")
+
+    def start_rom(self, rom_path: Path) -> None:
+        self._call_ui("start_rom", rom_path)
+
+    def set_paused(self, paused: bool) -> bool:
+        return self._call_ui("set_paused", paused)
+
+    def export_trace(self) -> Optional[Dict[str, Any]]:
+        """Get the render process's spans (see `trace.export`), or None if it isn't running."""
+        if self._fallback is None:
+            try:
+                with self._events_lock:
+                    self._events.send(("trace", ))
+                    return self._events.recv()
+            except (OSError, EOFError):
+                pass
+        return None
+
+    def _call_ui(self, name: str, *args: Any) -> Any:
+        if self._fallback is None:
+            try:
+                with self._events_lock:
+                    self._events.send(("call", name, args))
+                    (status, result) = self._events.recv()
+            except (OSError, EOFError):
+                self._fall_back()
+            else:
+                if status == "error":
+                    raise result
+                return result
+        return getattr(self._fallback, name)(*args)
+
+    def _fall_back(self) -> None:
+        """Run the UI in this process instead, once the render process has died."""
+        # The UI lock is taken first, as by every other caller into the UI.
+        with self.system.ui_lock:
+            if self._fallback is not None:
+                return
+            self._process.join(timeout=1.0)
+            if self._process.is_alive():
+                self._process.kill()
+            logging.error(
+                "Render process exited (exit code %s), running the UI in the main process",
+                self._process.exitcode,
+            )
+            # Stop the game (if one is running) and start again from the main menu.
+            gameboy = self.system.gameboy
+            gameboy.set_paused(True)
+            gameboy.set_overlay(False)
+            gameboy.persist_ram()
+            self.system.end_play()
+            self._fallback = ui.UI(self.system, resume=False)
+
+    def _serve(self) -> None:
+        """Serve requests from the render process."""
+        gameboy = self.system.gameboy
+        while True:
+            try:
+                request = self._requests.recv()
+            except EOFError:
+                if not self._stopping:
+                    self._fall_back()
+                return
+
+            kind = request[0]
+            if kind == "frame":
+                with trace.span("render_frame", seq=request[1]):
+                    try:
+                        gameboy.copy_framebuffer(self.framebuffer.frame(request[1]))
+                    finally:
+                        self._free_frames.release()
+                continue
+            if kind == "overlay":
+                try:
+                    gameboy.copy_overlay(self.framebuffer.overlay)
+                finally:
+                    self._free_overlay.release()
+                continue
+
+            try:
+                response = ("ok", self._handle(*request))
+            except Exception as e:
+                response = ("error", e)
+            try:
+                self._requests.send(response)
+            except Exception as e:
+                # The result (or exception) couldn't be pickled.
+                self._requests.send(("error", RuntimeError(f"{request[0]} {request[2]}: {e}")))
+
+    def _handle(self, kind: str, path: Tuple[str, ...], name: str, *args: Any) -> Any:
+        target = self.system
+        for attr in path:
+            target = getattr(target, attr)
+
+        if kind == "get":
+            value = getattr(target, name)
+            if isinstance(value, _VALUE_TYPES):
+                # Constants (upper case class attributes) can't change, so they only need to be sent once.
+                if name.isupper() and name not in getattr(target, "__dict__", {}):
+                    return ("constant", value)
+                return ("value", value)
+            if callable(value):
+                return ("method", None)
+            return ("object", None)
+        if kind == "set":
+            setattr(target, name, args[0])
+            return None
+        if kind == "call":
+            (call_args, call_kwargs) = args
+            return getattr(target, name)(*call_args, **call_kwargs)
+        raise ValueError(f"Unknown request: {kind}")
+
+
+class _Client:
+    """Sends requests to the main process, from any thread in the render process."""
+
+    def __init__(self, connection: "multiprocessing.connection.Connection") -> None:
+        self._connection = connection
+        self._lock = threading.Lock()
+
+    def request(self, *request: Any) -> Any:
+        with self._lock:
+            self._connection.send(request)
+            (status, result) = self._connection.recv()
+        if status == "error":
+            raise result
+        return result
+
+    def notify(self, *message: Any) -> None:
+        """Send a message that has no response."""
+        with self._lock:
+            self._connection.send(message)
+
+
+class RemoteObject:
+    """
+    Proxy for an object in the main process, at a path of attributes from the `System`.
+
+    Nested objects, methods and constants are looked up once. Other attributes are read every time.
+    """
+
+    def __init__(self, client: _Client, path: Tuple[str, ...] = ()) -> None:
+        object.__setattr__(self, "_client", client)
+        object.__setattr__(self, "_path", path)
+
+    def __getattr__(self, name: str) -> Any:
+        (kind, value) = self._client.request("get", self._path, name)
+        if kind == "value":
+            return value
+        if kind == "method":
+            client, path = self._client, self._path
+            value = lambda *args, **kwargs: client.request("call", path, name, args, kwargs)
+        elif kind == "object":
+            value = RemoteObject(self._client, self._path + (name, ))
+        object.__setattr__(self, name, value)
+        return value
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        self._client.request("set", self._path, name, value)
+
+
+class RemoteGameboy(RemoteObject):
+    """Proxy for the `Gameboy`, which passes frames through shared memory."""
+
+    def __init__(
+        self,
+        client: _Client,
+        framebuffer: SharedFramebuffer,
+        free_frames: "multiprocessing.synchronize.Semaphore",
+        free_overlay: "multiprocessing.synchronize.Semaphore",
+    ) -> None:
+        super().__init__(client, ("gameboy", ))
+        object.__setattr__(self, "_framebuffer", framebuffer)
+        object.__setattr__(self, "_free_frames", free_frames)
+        object.__setattr__(self, "_free_overlay", free_overlay)
+        object.__setattr__(self, "_seq", 0)
+        object.__setattr__(self, "_seq_lock", threading.Lock())
+
+    def copy_framebuffer(self, frame: np.ndarray) -> None:
+        with self._seq_lock:
+            seq = self._seq
+            object.__setattr__(self, "_seq", seq + 1)
+            # Wait for the frame that was last in this slot to be copied to the PL.
+            self._free_frames.acquire()
+            np.copyto(self._framebuffer.frame(seq), frame)
+            self._client.notify("frame", seq)
+
+    def copy_overlay(self, frame: np.ndarray) -> None:
+        self._free_overlay.acquire()
+        np.copyto(self._framebuffer.overlay, frame)
+        self._client.notify("overlay")
+
+
+class RemoteSystem(RemoteObject):
+    """Proxy for the `System`, as seen by the UI in the render process."""
+
+    def __init__(self, client: _Client, gameboy: RemoteGameboy, rom_library: library.RomLibrary) -> None:
+        super().__init__(client)
+        object.__setattr__(self, "gameboy", gameboy)
+        # Listing ROMs can be slow, so it is done in the render process too.
+        object.__setattr__(self, "library", rom_library)
+        object.__setattr__(self, "rom_directory", rom_library.rom_directory)
+
+
+def _run(
+    requests: "multiprocessing.connection.Connection",
+    events: "multiprocessing.connection.Connection",
+    framebuffer_name: str,
+    free_frames: "multiprocessing.synchronize.Semaphore",
+    free_overlay: "multiprocessing.synchronize.Semaphore",
+    rom_directory: Path,
+    slow_roots: List[Path],
+    tracing: bool,
+) -> None:
+    """Main function of the render process."""
+    logging.basicConfig(format='[%(asctime)s][%(processName)s][%(levelname)s] %(message)s', level=logging.DEBUG)
+    if tracing:
+        trace.enable()
+    client = _Client(requests)
+    framebuffer = SharedFramebuffer(framebuffer_name)
+    gameboy = RemoteGameboy(client, framebuffer, free_frames, free_overlay)
+    system = RemoteSystem(client, gameboy, library.RomLibrary(rom_directory, slow_roots))
+    the_ui = ui.UI(system)
+
+    while True:
+        try:
+            event = events.recv()
+        except EOFError:
+            return
+        if event[0] == "button":
+            try:
+                the_ui.on_button_state(event[1], event[2])
+            except Exception:
+                logging.exception("Error handling %s", event)
+        elif event[0] == "call":
+            try:
+                response = ("ok", getattr(the_ui, event[1])(*event[2]))
+            except Exception as e:
+                response = ("error", e)
+            events.send(response)
+        elif event[0] == "trace":
+            events.send(trace.export())
@@ -0,0 +1,190 @@
+"""
+ROM files, stored either raw or in a compressed archive (zip, gzip, or xz).
+"""
+
+import contextlib
+import gzip
+import hashlib
+import logging
+import lzma
+import os
+import shutil
+import struct
+import zipfile
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, Tuple
+
+ROM_SUFFIXES = (".gb", ".gbc")
+ARCHIVE_SUFFIXES = (".zip", ".gz", ".xz")
+# The cartridge header ends at 0x14F.
+HEADER_SIZE = 0x150
+CHUNK_SIZE = 64 * 1024
+
+# Errors that can be raised while reading a (possibly corrupt) ROM file or archive.
+ROM_READ_ERRORS = (OSError, EOFError, ValueError, zipfile.BadZipFile, lzma.LZMAError, zlib.error)
+
+
+class RomLoadException(Exception):
+    pass
+
+
+def header_title(header: bytes) -> str:
+    """The title from a cartridge header."""
+    # On Game Boy Color cartridges, the last byte of the title is the CGB flag (0x80 or 0xC0).
+    end = 0x143 if header[0x143] >= 0x80 else 0x144
+    return bytes(header[0x134:end]).split(b"\0")[0].decode("ascii", errors="replace").strip()
+
+
+def is_archive(path: Path) -> bool:
+    return path.suffix.lower() in ARCHIVE_SUFFIXES
+
+
+def is_rom_file(path: Path) -> bool:
+    """Whether the path looks like a ROM file or a ROM archive, based on its name."""
+    suffix = path.suffix.lower()
+    if suffix in ROM_SUFFIXES or suffix == ".zip":
+        return True
+    if suffix in (".gz", ".xz"):
+        return Path(path.stem).suffix.lower() in ROM_SUFFIXES
+    return False
+
+
+def list_roms(directory: Path) -> List[Path]:
+    """List the ROM files and archives in a directory, sorted by name."""
+    return sorted(p for p in directory.iterdir() if p.is_file() and is_rom_file(p))
+
+
+def save_path(rom_path: Path) -> Path:
+    """Path of the save file for a ROM. Archived ROMs share the save file of the raw ROM."""
+    if rom_path.suffix.lower() in (".gz", ".xz"):
+        rom_path = rom_path.with_suffix("")
+    return rom_path.with_suffix(".sav")
+
+
+def _find_zip_member(archive: zipfile.ZipFile) -> zipfile.ZipInfo:
+    for info in archive.infolist():
+        if Path(info.filename).suffix.lower() in ROM_SUFFIXES:
+            return info
+    raise ValueError("No ROM in archive")
+
+
+@contextlib.contextmanager
+def open_rom(path: Path) -> Iterator[Tuple[BinaryIO, Optional[int]]]:
+    """
+    Open a ROM file for streaming, decompressing it if needed.
+
+    Yields the stream and the size of the (decompressed) ROM, or None if it isn't known up front.
+    """
+    suffix = path.suffix.lower()
+    if suffix == ".zip":
+        with zipfile.ZipFile(path) as archive:
+            info = _find_zip_member(archive)
+            with archive.open(info) as stream:
+                yield stream, info.file_size
+    elif suffix == ".gz":
+        with open(path, "rb") as f:
+            # The gzip trailer holds the uncompressed size (mod 2^32).
+            f.seek(-4, os.SEEK_END)
+            (size, ) = struct.unpack("<I", f.read(4))
+            f.seek(0)
+            with gzip.GzipFile(fileobj=f) as stream:
+                yield stream, size
+    elif suffix == ".xz":
+        with lzma.open(path) as stream:
+            yield stream, None
+    else:
+        with open(path, "rb") as stream:
+            yield stream, os.fstat(stream.fileno()).st_size
+
+
+def read_into(stream: BinaryIO, buffer, crc32: int = 0) -> Tuple[int, int]:
+    """
+    Read from the stream into a (contiguous) buffer in chunks, until it is full. Returns the bytes read,
+    and the CRC32 of them continued from `crc32` (hashed chunk by chunk, while they are still in cache).
+    """
+    view = memoryview(buffer).cast("B")
+    offset = 0
+    while offset < len(view):
+        n = stream.readinto(view[offset:(offset + CHUNK_SIZE)])
+        if not n:
+            break
+        crc32 = zlib.crc32(view[offset:(offset + n)], crc32)
+        offset += n
+    return offset, crc32
+
+
+class CachedImage(NamedTuple):
+    path: Path
+    # CRC32 of the image, to check it against as it is loaded
+    crc32: int
+
+
+class ImageCache:
+    """
+    Cache of ROM images on local disk: decompressed images of archives, so that they only need to be
+    decompressed once, and copies of ROMs from slow storage (see `library`).
+
+    Images are named after the path, size and modification time of the ROM file, and their CRC32. If
+    the ROM file can't be reached (e.g. its drive isn't mounted), its latest image is used instead.
+    Least recently used images are evicted to keep at least `min_free_bytes` free on the disk.
+    """
+
+    def __init__(self, directory: Path, min_free_bytes: int = 256 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.min_free_bytes = min_free_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _prefix(self, rom_path: Path) -> str:
+        return hashlib.sha1(str(rom_path.absolute()).encode()).hexdigest()
+
+    def lookup(self, rom_path: Path) -> Optional[CachedImage]:
+        """Get the cached image of the ROM file, if there is one."""
+        prefix = self._prefix(rom_path)
+        try:
+            stat = rom_path.stat()
+        except OSError as e:
+            images = sorted(self.directory.glob(f"{prefix}-*.gb"), key=lambda p: p.stat().st_mtime)
+            if not images:
+                return None
+            logging.info("Using cached image of %s, which can't be reached: %s", rom_path, e)
+            image_path = images[-1]
+        else:
+            images = list(self.directory.glob(f"{prefix}-{stat.st_size}-{stat.st_mtime_ns}-*.gb"))
+            if not images:
+                return None
+            image_path = images[0]
+        # Mark as recently used.
+        os.utime(image_path)
+        return CachedImage(image_path, int(image_path.stem.rsplit("-", 1)[1], 16))
+
+    def store(self, rom_path: Path, stat: os.stat_result, data: bytes, crc32: int) -> None:
+        """Store the image of the ROM file, as it was when `stat` was taken, if there is space for it."""
+        prefix = self._prefix(rom_path)
+        image_path = self.directory / f"{prefix}-{stat.st_size}-{stat.st_mtime_ns}-{crc32:08x}.gb"
+        try:
+            if not self._make_space(len(data)):
+                logging.info("Not enough disk space to cache %s", rom_path)
+                return
+            # Stale images of the same ROM file (from before it was modified) are no longer useful.
+            for stale_path in self.directory.glob(f"{prefix}-*.gb"):
+                stale_path.unlink(missing_ok=True)
+            temp_path = image_path.with_suffix(".tmp")
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, image_path)
+        except OSError as e:
+            logging.warning("Could not cache %s: %s", rom_path, e)
+            return
+        logging.info("Cached image of %s", rom_path)
+
+    def discard(self, image: CachedImage) -> None:
+        image.path.unlink(missing_ok=True)
+
+    def _make_space(self, size: int) -> bool:
+        images = sorted(self.directory.glob("*.gb"), key=lambda p: p.stat().st_mtime)
+        while shutil.disk_usage(self.directory).free - size < self.min_free_bytes:
+            if not images:
+                return False
+            images.pop(0).unlink(missing_ok=True)
+        return True
@@ -0,0 +1,153 @@
+"""
+State of the last session, persisted so that it can be restored on the next boot.
+
+This module must not depend on Pynq, so that the last game can be read while Pynq is still loading.
+"""
+
+from enum import Enum
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+from typing import Optional
+import zlib
+
+from . import romfile
+
+
+class CartridgeMode(Enum):
+    PHYSICAL = "physical"
+    EMULATED = "emulated"
+
+
+class InputMode(Enum):
+    LIVE = "live"
+    RECORD = "record"
+    REPLAY = "replay"
+
+
+class Session:
+    FILENAME = ".gameboy_ps_session.json"
+
+    def __init__(self, rom_directory: Path) -> None:
+        self.rom_directory = rom_directory
+        # Path of the last ROM, relative to the ROM directory
+        self.last_rom: Optional[str] = None
+        self.list_pos = 0
+        self.cartridge = CartridgeMode.EMULATED
+        self.auto_resume = False
+        self.input_mode = InputMode.LIVE
+
+    @property
+    def path(self) -> Path:
+        return self.rom_directory / self.FILENAME
+
+    @property
+    def last_rom_path(self) -> Optional[Path]:
+        if self.last_rom is None:
+            return None
+        return self.rom_directory / self.last_rom
+
+    @property
+    def can_resume(self) -> bool:
+        """Whether the last game should be started at boot."""
+        if not self.auto_resume:
+            return False
+        return self.cartridge == CartridgeMode.PHYSICAL or self.last_rom is not None
+
+    @staticmethod
+    def load(rom_directory: Path) -> "Session":
+        session = Session(rom_directory)
+        try:
+            data = json.loads(session.path.read_text())
+            session.last_rom = data.get("last_rom")
+            session.list_pos = int(data.get("list_pos", 0))
+            session.cartridge = CartridgeMode(data.get("cartridge", CartridgeMode.EMULATED.value))
+            session.auto_resume = bool(data.get("auto_resume", False))
+            session.input_mode = InputMode(data.get("input_mode", InputMode.LIVE.value))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning("Could not read session state: %s", e)
+        return session
+
+    def save(self) -> None:
+        data = {
+            "last_rom": self.last_rom,
+            "list_pos": self.list_pos,
+            "cartridge": self.cartridge.value,
+            "auto_resume": self.auto_resume,
+            "input_mode": self.input_mode.value,
+        }
+        temp_path = self.path.with_suffix(".tmp")
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logging.warning("Could not write session state: %s", e)
+
+    def set_emulated_rom(self, rom_path: Path) -> None:
+        self.cartridge = CartridgeMode.EMULATED
+        # ROMs outside of the ROM directory (in other library roots) are stored by absolute path.
+        if rom_path.is_relative_to(self.rom_directory):
+            self.last_rom = str(rom_path.relative_to(self.rom_directory))
+        else:
+            self.last_rom = str(rom_path)
+
+
+class Preload:
+    """
+    Reads a ROM (decompressing it if needed) and its save file in the background.
+
+    If `cache` is given, the cached image of the ROM is read instead, if there is one.
+    """
+
+    def __init__(self, rom_path: Path, cache: Optional[romfile.ImageCache] = None) -> None:
+        self.rom_path = rom_path
+        self.cache = cache
+        self._rom_data: Optional[bytes] = None
+        # Stat of the ROM file from before it was read, if it was read from the file rather than the cache
+        self.rom_stat: Optional[os.stat_result] = None
+        self._save_data: Optional[bytes] = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _read_cached(self) -> Optional[bytes]:
+        image = self.cache.lookup(self.rom_path) if self.cache is not None else None
+        if image is None:
+            return None
+        data = image.path.read_bytes()
+        if zlib.crc32(data) != image.crc32:
+            logging.warning("Cached image of %s is corrupt", self.rom_path)
+            self.cache.discard(image)
+            return None
+        return data
+
+    def _run(self) -> None:
+        try:
+            self._rom_data = self._read_cached()
+            if self._rom_data is None:
+                self.rom_stat = self.rom_path.stat()
+                with romfile.open_rom(self.rom_path) as (stream, _):
+                    self._rom_data = stream.read()
+            save_path = romfile.save_path(self.rom_path)
+            if save_path.is_file():
+                self._save_data = save_path.read_bytes()
+            logging.info("Preloaded %s", self.rom_path)
+        except romfile.ROM_READ_ERRORS as e:
+            logging.warning("Could not preload %s: %s", self.rom_path, e)
+            self._rom_data = None
+
+    @property
+    def rom_data(self) -> Optional[bytes]:
+        """The ROM data, or None if it couldn't be read. Waits for the preload to finish."""
+        self._thread.join()
+        return self._rom_data
+
+    @property
+    def save_data(self) -> Optional[bytes]:
+        """The save file data, or None if there is none. Waits for the preload to finish."""
+        self._thread.join()
+        return self._save_data
@@ -1,34 +1,161 @@
 #!/usr/bin/env python3
 
 import signal
+import struct
+import threading
 import time
 import logging
 
 from pathlib import Path
 from typing import Optional
 
-from .gameboy import Gameboy
-from . import controller, ui
+from .gameboy import Gameboy, RomImage
+from . import control, controller, history, library, recording, render, romfile, session, trace, ui
 
 class System:
-    def __init__(self, rom_directory: Path):
+    def __init__(
+        self,
+        rom_directory: Path,
+        trace_path: Optional[Path] = None,
+        rom_cache: Optional[romfile.ImageCache] = None,
+        last_session: Optional[session.Session] = None,
+        preload: Optional[session.Preload] = None,
+        control_socket: Optional[Path] = None,
+        control_http_port: Optional[int] = None,
+        rom_library: Optional[library.RomLibrary] = None,
+        render_process: bool = False,
+    ):
+        # Tracing is enabled before anything else so that the startup is traced too.
+        if trace_path is not None:
+            trace.enable()
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self._dump_trace(trace_path))
+            logging.info("Tracing enabled, send SIGUSR1 to write trace to %s", trace_path)
+
+        self.rom_directory = rom_directory
+        self.library = rom_library if rom_library is not None else library.RomLibrary(rom_directory)
+        self.rom_cache = rom_cache
+        self.session = last_session if last_session is not None else session.Session.load(rom_directory)
+        # Preloaded last game, if it is being resumed
+        self.preload = preload
+        # ROM read by `prepare_rom`, for the next `load_rom`
+        self._prepared_rom: Optional[RomImage] = None
+        self.history = history.History(rom_directory)
         self.gameboy = Gameboy()
+        # Whether a play session (since the last reset) is in progress
+        self.playing = False
         self.buttons = {e: False for e in controller.Button}
-        self.ui = ui.UI(self)
-        self.rom_directory = rom_directory
+        self.input_recorder: Optional[recording.Recorder] = None
+        self.input_replayer: Optional[recording.Replayer] = None
+        # The UI is driven from the controller threads and the control API.
+        self.ui_lock = threading.RLock()
+        # The UI runs either in this process, or in a render process that it stands in for.
+        self.render_process = render.RenderProcess(self) if render_process else None
+        self.ui = self.render_process or ui.UI(self)
 
         # Set up controllers.
-        def controller_callback(button: controller.Button, pressed: bool) -> None:
+        controllers = [c(self.on_button) for c in controller.CONTROLLER_LISTENERS]
+
+        if control_socket is not None:
+            control.ControlServer(self, control_socket, control_http_port).start()
+
+        logging.info("Initialization complete.")
+
+    def on_button(self, button: controller.Button, pressed: bool) -> None:
+        """Controller callback."""
+        # The joypad is driven by the replay instead, if there is one.
+        if self.input_replayer is None:
             self.gameboy.set_button(button, pressed)
 
-            was_pressed = self.buttons[button]
-            if was_pressed != pressed:
+        with self.ui_lock:
+            if self.buttons[button] == pressed:
+                # Polled controllers call back with every button state, changed or not.
+                return
+            with trace.span("controller_callback", button=button.name, pressed=pressed):
                 self.buttons[button] = pressed
-                self.ui.on_button_state(button, pressed)     
-    
-        controllers = [c(controller_callback) for c in controller.CONTROLLER_LISTENERS]
+                recorder = self.input_recorder
+                if recorder is not None:
+                    recorder.on_button(button, pressed)
+                self.ui.on_button_state(button, pressed)
 
-        logging.info("Initialization complete.")
+    def _dump_trace(self, trace_path: Path) -> None:
+        # Runs in the signal handler, so errors must not escape into the main loop.
+        try:
+            others = []
+            if self.render_process is not None:
+                render_trace = self.render_process.export_trace()
+                if render_trace is not None:
+                    others.append(render_trace)
+            trace.dump(trace_path, *others)
+        except OSError as e:
+            logging.warning("Could not write trace to %s: %s", trace_path, e)
+
+    def prepare_rom(self, rom_path: Path) -> None:
+        """
+        Read a ROM for the next `load_rom`, without changing the cartridge. Raises RomLoadException if
+        it can't be read.
+        """
+        cache = self.rom_cache if self.library.should_cache(rom_path) else None
+        preload = self.preload
+        if preload is not None and preload.rom_path == rom_path:
+            rom = self.gameboy.read_rom(rom_path, cache, rom_data=preload.rom_data, rom_stat=preload.rom_stat)
+        else:
+            rom = self.gameboy.read_rom(rom_path, cache)
+        self._prepared_rom = rom
+
+    def load_rom(self, rom_path: Path) -> None:
+        """
+        Load a ROM as the emulated cartridge, reading it first unless it has been prepared. Raises
+        RomLoadException if it can't be loaded (leaving the cartridge unchanged).
+        """
+        rom, self._prepared_rom = self._prepared_rom, None
+        if rom is None or rom.path != rom_path:
+            self.prepare_rom(rom_path)
+            rom, self._prepared_rom = self._prepared_rom, None
+        preload, self.preload = self.preload, None
+        save_data = preload.save_data if preload is not None and preload.rom_path == rom_path else None
+        self.gameboy.set_emulated_rom(rom, save_data)
+
+    def begin_play(self) -> None:
+        """Reset the Game Boy and start a play session of the loaded cartridge."""
+        # Stop recording first, so the recording ends at the clock count from before the reset zeroes it.
+        self.stop_input()
+        self.end_play()
+        self.gameboy.reset()
+        self.start_input()
+        self.playing = True
+
+    def end_play(self) -> None:
+        """End the play session (if there is one), and record it in the performance history."""
+        self.stop_input()
+        if not self.playing:
+            return
+        self.playing = False
+        if self.session.cartridge == session.CartridgeMode.EMULATED:
+            self.history.record_session(self.gameboy)
+
+    def start_input(self) -> None:
+        """Start recording or replaying input (depending on the input mode). Call right after a reset."""
+        self.stop_input()
+        rom_path = self.session.last_rom_path
+        if self.session.cartridge != session.CartridgeMode.EMULATED or rom_path is None:
+            return
+
+        if self.session.input_mode == session.InputMode.RECORD:
+            self.input_recorder = recording.Recorder(self.gameboy, rom_path)
+        elif self.session.input_mode == session.InputMode.REPLAY:
+            try:
+                self.input_replayer = recording.Replayer(self.gameboy, rom_path)
+            except (OSError, ValueError, struct.error) as e:
+                logging.warning("Could not replay input for %s: %s", rom_path, e)
+
+    def stop_input(self) -> None:
+        """Stop recording (and save the recording) or replaying input."""
+        if self.input_recorder is not None:
+            self.input_recorder.stop()
+            self.input_recorder = None
+        if self.input_replayer is not None:
+            self.input_replayer.stop()
+            self.input_replayer = None
 
     def start(self) -> None:
         # self.gameboy.set_paused(False)
@@ -40,4 +167,7 @@ class System:
             pass
 
         self.gameboy.set_paused(True)
+        self.end_play()
         self.gameboy.persist_ram()
+        if self.render_process is not None:
+            self.render_process.stop()
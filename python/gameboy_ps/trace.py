@@ -0,0 +1,128 @@
+"""
+Lightweight span tracing for the PS side, exported in the Chrome trace event format.
+
+The exported JSON can be loaded in chrome://tracing or https://ui.perfetto.dev.
+Tracing is disabled by default, in which case spans cost little more than a function call.
+"""
+
+import collections
+import contextlib
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+DEFAULT_CAPACITY = 64 * 1024
+
+# (name, start ns, duration ns, thread id, args)
+_Event = Tuple[str, int, int, int, Optional[Dict[str, Any]]]
+
+_enabled = False
+_events: Deque[_Event] = collections.deque(maxlen=DEFAULT_CAPACITY)
+_thread_names: Dict[int, str] = {}
+_null_span = contextlib.nullcontext()
+
+
+def enable(capacity: int = DEFAULT_CAPACITY) -> None:
+    """Start recording spans, keeping at most `capacity` of the most recent ones."""
+    global _enabled, _events
+    if capacity != _events.maxlen:
+        _events = collections.deque(_events, maxlen=capacity)
+    _enabled = True
+
+
+def disable() -> None:
+    """Stop recording spans. Already recorded spans are kept."""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def clear() -> None:
+    _events.clear()
+
+
+class _Span:
+    __slots__ = ("_name", "_args", "_start")
+
+    def __init__(self, name: str, args: Optional[Dict[str, Any]]) -> None:
+        self._name = name
+        self._args = args
+
+    def __enter__(self) -> None:
+        self._start = time.perf_counter_ns()
+
+    def __exit__(self, *exc_info) -> None:
+        end = time.perf_counter_ns()
+        thread_id = threading.get_ident()
+        if thread_id not in _thread_names:
+            _thread_names[thread_id] = threading.current_thread().name
+        _events.append((self._name, self._start, end - self._start, thread_id, self._args))
+
+
+def span(name: str, **args: Any) -> contextlib.AbstractContextManager:
+    """Context manager that records the time spent inside it as a span."""
+    if not _enabled:
+        return _null_span
+    return _Span(name, args or None)
+
+
+def traced(name: Optional[str] = None) -> Callable[[Callable], Callable]:
+    """Decorator that records each call of the function as a span (named after the function by default)."""
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(span_name, None):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def export() -> Dict[str, Any]:
+    """Get the recorded spans as a Chrome trace JSON object."""
+    pid = os.getpid()
+    trace_events: List[Dict[str, Any]] = [{
+        "name": "process_name", "ph": "M", "pid": pid,
+        "args": {"name": multiprocessing.current_process().name},
+    }]
+    for thread_id, thread_name in list(_thread_names.items()):
+        trace_events.append({
+            "name": "thread_name", "ph": "M", "pid": pid, "tid": thread_id,
+            "args": {"name": thread_name},
+        })
+    for (name, start, duration, thread_id, args) in _events.copy():
+        event = {
+            "name": name, "ph": "X", "pid": pid, "tid": thread_id,
+            "ts": start / 1000, "dur": duration / 1000,
+        }
+        if args is not None:
+            event["args"] = {k: str(v) for (k, v) in args.items()}
+        trace_events.append(event)
+    return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+
+def dump(path: Path, *others: Dict[str, Any]) -> None:
+    """
+    Write the recorded spans to `path` as Chrome trace JSON, along with the spans of other processes
+    (exported with `export`).
+    """
+    data = export()
+    for other in others:
+        data["traceEvents"].extend(other["traceEvents"])
+    with open(path, "w") as f:
+        json.dump(data, f)
+    logging.info("Wrote %d trace events to %s", len(data["traceEvents"]), path)
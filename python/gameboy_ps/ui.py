@@ -2,14 +2,20 @@ import abc
 from enum import Enum
 import importlib.resources
 import logging
-from typing import List
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
 from pathlib import Path
+import threading
+import time
 
+import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 
 from .controller import Button
+from .framebuffer import OVERLAY_LINES
 from . import resources
-from .gameboy import Gameboy, RomLoadException
+from .romfile import RomLoadException
+from . import trace
+from .session import CartridgeMode, InputMode
 
 def rgba_to_i16(r, g, b, a = 255):
     if a == 0:
@@ -25,6 +31,10 @@ def convert_image(image: Image) -> Image:
             output_data[i, j] = rgba_to_i16(*input_data[i, j])
     return output
 
+def image_to_frame(image: Image) -> np.ndarray:
+    """Convert a mode 'I' image to a (height, width) uint16 array in the PL framebuffer format."""
+    return np.asarray(image, dtype=np.int32).astype(np.uint16)
+
 COLOR_TRANSPARENT = 0
 COLOR_BG = rgba_to_i16(236, 236, 236)
 COLOR_BLACK = rgba_to_i16(0, 0, 0)
@@ -38,7 +48,8 @@ class ButtonEvent(Enum):
     RELEASED = 1
 
 class UI:
-    def __init__(self, system: "System") -> None:
+    def __init__(self, system: "System", resume: bool = True) -> None:
+        """If `resume` is set, the game from the last session is started (if it should be resumed at boot)."""
         self.system = system
         self.width = 160
         self.height = 144
@@ -51,9 +62,34 @@ class UI:
         with (importlib.resources.files(resources) / "logo.png") as r:
             self.logo = convert_image(Image.open(r))
 
-        self.screen = MainMenuScreen(self)
+        # Fully rendered frames (or static layers of frames), keyed by screen and state.
+        self._frame_cache: Dict[Hashable, np.ndarray] = {}
+        self.hud = Hud(self)
+
+        self.screen = (self._resume_screen() if resume else None) or MainMenuScreen(self)
         self.screen.on_attach()
 
+    def _resume_screen(self) -> Optional["Screen"]:
+        """Start the game from the last session, if it should be resumed."""
+        session = self.system.session
+        if not session.can_resume:
+            return None
+        gameboy = self.system.gameboy
+        if session.cartridge == CartridgeMode.PHYSICAL:
+            logging.info("Resuming physical cartridge")
+            gameboy.set_physical_cartridge()
+            return GameScreen(self)
+
+        rom_path = session.last_rom_path
+        logging.info("Resuming %s", rom_path)
+        try:
+            self.system.load_rom(rom_path)
+        except RomLoadException as e:
+            logging.warning("Could not resume %s: %s", rom_path, e)
+            return None
+        return GameScreen(self)
+
+    @trace.traced()
     def on_button_state(self, button: Button, pressed: bool) -> None:
         if pressed:
             self.screen.on_button_event(button, ButtonEvent.PRESSED)
@@ -64,8 +100,80 @@ class UI:
         self.screen = screen
         self.screen.on_attach()
 
+    def _stop_game(self) -> None:
+        self.hud.stop()
+        self.system.gameboy.set_paused(True)
+        # Save before the cartridge (and its RAM buffer) is replaced.
+        self.system.gameboy.persist_ram()
+        self.system.end_play()
+
+    def start_cartridge(self) -> None:
+        """Start playing the physical cartridge."""
+        self._stop_game()
+        self.system.session.cartridge = CartridgeMode.PHYSICAL
+        self.system.session.save()
+        self.system.gameboy.set_physical_cartridge()
+        self.set_screen(GameScreen(self))
+
+    def start_rom(self, rom_path: Path) -> None:
+        """Start playing a ROM file. Raises RomLoadException if it can't be loaded."""
+        # Read the ROM first, so that the current game is left running if it can't be read.
+        self.system.prepare_rom(rom_path)
+        self._stop_game()
+        try:
+            self.system.load_rom(rom_path)
+        except RomLoadException:
+            # The current game has been stopped, so go back to the main menu.
+            self.set_screen(MainMenuScreen(self))
+            raise
+        self.system.session.set_emulated_rom(rom_path)
+        self.system.session.save()
+        self.set_screen(GameScreen(self))
+
+    def set_paused(self, paused: bool) -> bool:
+        """Pause (showing the pause menu) or resume the running game. Returns false if no game is shown."""
+        if not isinstance(self.screen, GameScreen):
+            return False
+        if paused and self.screen.playing:
+            self.screen.pause()
+        elif not paused and not self.screen.playing:
+            self.screen.resume()
+        return True
+
     def show_framebuffer(self) -> None:
-        self.system.gameboy.copy_framebuffer(self.framebuffer)
+        self.show_frame(image_to_frame(self.framebuffer))
+
+    def show_frame(self, frame: np.ndarray) -> None:
+        self.system.gameboy.copy_framebuffer(frame)
+
+    def cached_frame(self, key: Hashable, render: Callable[[], None]) -> np.ndarray:
+        """
+        Get the frame stored under `key`, rendering it first if needed.
+
+        `render` draws the full frame into the framebuffer. The returned array must not be modified.
+        """
+        frame = self._frame_cache.get(key)
+        if frame is None:
+            render()
+            frame = image_to_frame(self.framebuffer)
+            self._frame_cache[key] = frame
+        return frame
+
+    def render_region(
+        self, base: np.ndarray, box: Tuple[int, int, int, int], render: Callable[[], None]
+    ) -> np.ndarray:
+        """
+        Get a copy of `base` with the region `box` (left, top, right, bottom) redrawn by `render`.
+
+        The region is reset to its contents in `base` before `render` is called. `render` draws
+        in framebuffer coordinates; anything it draws outside of the region is discarded.
+        """
+        x0, y0, x1, y1 = box
+        frame = base.copy()
+        self.framebuffer.paste(Image.fromarray(frame[y0:y1, x0:x1].astype(np.int32)), (x0, y0))
+        render()
+        frame[y0:y1, x0:x1] = image_to_frame(self.framebuffer.crop(box))
+        return frame
 
 class Screen(abc.ABC):
     def on_attach(self) -> None:
@@ -93,43 +201,71 @@ class MainMenuScreen(Screen):
             if button == Button.A:
                 if self._select_widget.pos == 0:
                     # Run cartridge
-                    self.ui.system.gameboy.set_physical_cartridge()
-                    self.ui.set_screen(GameScreen(self.ui))
+                    self.ui.start_cartridge()
                     return
                 if self._select_widget.pos == 1:
                     # Load ROM file
                     self.ui.set_screen(RomSelectScreen(self.ui))
                     return
+                if self._select_widget.pos == 2:
+                    # Options
+                    self.ui.set_screen(OptionsScreen(self.ui))
+                    return
 
         self._render()
 
+    @trace.traced()
     def _render(self) -> None:
+        key = ("main_menu", self._select_widget.pos)
+        self.ui.show_frame(self.ui.cached_frame(key, self._draw))
+
+    def _draw(self) -> None:
         self.ui.draw.rectangle([(0, 0), (self.ui.width, self.ui.height)], fill=COLOR_BG)
         self.ui.framebuffer.paste(self.ui.logo, (15, 24))
         self._select_widget.render(self.ui, 30, 70, 100, 50)
-        self.ui.show_framebuffer()
 
 
 class GameScreen(Screen):
     def __init__(self, ui: UI) -> None:
         self.ui = ui
         self.playing = True
-        self._widget = SelectWidget(["Resume", "Reset", "Stats", "Main Menu"])
+        self._widget = SelectWidget(["Resume", "Reset", "Stats", self._hud_label(), "Main Menu"])
 
-        self.ui.system.gameboy.reset()
-        self.ui.system.gameboy.set_paused(False)
+        # Pre-render every menu state so the menu can be shown as soon as HOME is pressed.
+        for pos in range(len(self._widget.items)):
+            self._widget.pos = pos
+            self._menu_frame()
+        self._widget.pos = 0
+
+        self.ui.system.begin_play()
+        self.resume()
 
     def on_attach(self) -> None:
         self._render()
 
+    def resume(self) -> None:
+        """Resume the game, from the pause menu."""
+        self.ui.system.gameboy.set_paused(False)
+        self.playing = True
+        if self.ui.hud.enabled:
+            self.ui.hud.start()
+
+    def pause(self) -> None:
+        """Pause the game, and show the pause menu."""
+        self.playing = False
+        self.ui.hud.stop()
+        self.ui.system.gameboy.set_paused(True)
+        self._widget.pos = 0
+        self._render()
+        self.ui.system.gameboy.persist_ram()
+
+    def _hud_label(self) -> str:
+        return "Hide HUD" if self.ui.hud.enabled else "Show HUD"
+
     def on_button_event(self, button: Button, event: ButtonEvent) -> None:
         if self.playing:
             if button == Button.HOME and event == ButtonEvent.PRESSED:
-                self.playing = False
-                self.ui.system.gameboy.set_paused(True)
-                self.ui.system.gameboy.persist_ram()
-                self._widget.pos = 0
-                self._render()
+                self.pause()
             return
 
         if event == ButtonEvent.PRESSED:
@@ -138,63 +274,76 @@ class GameScreen(Screen):
             if button == Button.DOWN:
                 self._widget.move_down()
             if button == Button.HOME:
-                self.ui.system.gameboy.set_paused(False)
-                self.playing = True
+                self.resume()
                 return
             if button == Button.A:
                 if self._widget.pos == 0:
                     # Resume
-                    self.ui.system.gameboy.set_paused(False)
-                    self.playing = True
+                    self.resume()
                     return
                 if self._widget.pos == 1:
                     # Reset
-                    self.ui.system.gameboy.reset()
-                    self.ui.system.gameboy.set_paused(False)
-                    self.playing = True
+                    self.ui.system.begin_play()
+                    self.resume()
                     return
                 if self._widget.pos == 2:
                     # Display Stats
                     self.ui.set_screen(StatsScreen(self.ui, self))
                     return
                 if self._widget.pos == 3:
+                    # Toggle HUD
+                    self.ui.hud.enabled = not self.ui.hud.enabled
+                    self._widget.items[3] = self._hud_label()
+                if self._widget.pos == 4:
                     # Main Menu
+                    self.ui.system.end_play()
                     self.ui.set_screen(MainMenuScreen(self.ui))
                     return
             self._render()
 
+    @trace.traced()
     def _render(self) -> None:
         if self.playing:
             return
+        self.ui.show_frame(self._menu_frame())
+
+    def _menu_frame(self) -> np.ndarray:
+        key = ("game_menu", self._widget.pos, self.ui.hud.enabled)
+        return self.ui.cached_frame(key, self._draw)
+
+    def _draw(self) -> None:
         self.ui.draw.rectangle([(0, 0), (self.ui.width, self.ui.height)], fill=COLOR_TRANSPARENT)
-        self.ui.draw.rectangle([(30, 30), (130, 144 - 30)], fill=COLOR_BG)
-        self.ui.draw.rectangle([(30, 30), (130, 144 - 30)], outline=COLOR_BLACK)
-        self._widget.render(self.ui, 40, 40, 80, 70)
-        self.ui.show_framebuffer()
+        self.ui.draw.rectangle([(30, 22), (130, 144 - 22)], fill=COLOR_BG)
+        self.ui.draw.rectangle([(30, 22), (130, 144 - 22)], outline=COLOR_BLACK)
+        self._widget.render(self.ui, 40, 32, 80, 86)
 
 
 class RomSelectScreen(Screen):
-    list_pos = 0
-
     def __init__(self, ui: UI) -> None:
         self.ui = ui
-        rom_directory = self.ui.system.rom_directory
-        self.roms = []
-        self.roms.extend(rom_directory.glob("*.gb"))
-        self.roms.extend(rom_directory.glob("*.gbc"))
-        self.roms.sort()
-        rom_filenames = [str(x.relative_to(rom_directory)) for x in self.roms]
+        self._error = None
+        self._list_roms(self.ui.system.session.list_pos)
+
+    def _list_roms(self, pos: int) -> None:
+        library = self.ui.system.library
+        self.roms = library.list_roms()
+        # If the slow library roots are still being listed, they are listed again on the next button press.
+        self._scanning = library.scanning
+        rom_filenames = [library.name(x) for x in self.roms]
         self._widget = ListWidget(rom_filenames, lines=9)
-        widget_pos = min(RomSelectScreen.list_pos, len(rom_filenames) - 1)
+        widget_pos = min(pos, len(rom_filenames) - 1)
         for i in range(widget_pos):
             self._widget.move_down()
-        self._error = None
 
     def on_attach(self) -> None:
         self._render()
 
     def on_button_event(self, button: Button, event: ButtonEvent) -> None:
         if event == ButtonEvent.PRESSED:
+            if self._scanning and not self.ui.system.library.scanning:
+                # Switch to the full listing, now that it's ready. The ROMs listed so far keep their positions.
+                self._list_roms(self._widget.pos)
+
             if self._error is not None:
                 self._error = None
                 self._render()
@@ -207,29 +356,37 @@ class RomSelectScreen(Screen):
                 self._widget.move_down()
 
             if button == Button.B:
-                RomSelectScreen.list_pos = self._widget.pos
+                self.ui.system.session.list_pos = self._widget.pos
+                self.ui.system.session.save()
                 self.ui.set_screen(MainMenuScreen(self.ui))
                 return
 
             if button == Button.A:
-                RomSelectScreen.list_pos = self._widget.pos
-                rom_path = self.roms[self._widget.pos]
+                self.ui.system.session.list_pos = self._widget.pos
                 try:
-                    self.ui.system.gameboy.set_emulated_cartridge(rom_path)
+                    self.ui.start_rom(self.roms[self._widget.pos])
                 except RomLoadException as e:
                     self._error = str(e)
-                    return
-                self.ui.set_screen(GameScreen(self.ui))
                 return
 
         self._render()
         
+    # Region redrawn on top of the static background: the list, its cursor, and the error modal.
+    LIST_REGION = (5, 17, 160, 132)
+    ERROR_REGION = (0, 0, 160, 144)
+
+    @trace.traced()
     def _render(self) -> None:
+        background = self.ui.cached_frame(("rom_select", self._scanning), self._draw_background)
+        region = self.LIST_REGION if self._error is None else self.ERROR_REGION
+        self.ui.show_frame(self.ui.render_region(background, region, self._draw))
+
+    def _draw_background(self) -> None:
         self.ui.draw.rectangle([(0, 0), (self.ui.width, self.ui.height)], fill=COLOR_BG)
         self.ui.draw.rectangle([(4, 16), (160 - 8, 144 - 16)], outline=COLOR_BLACK)
         self.ui.draw.text(
             (4, 4),
-            "Load ROM file...",
+            "Load ROM file (scanning...)" if self._scanning else "Load ROM file...",
             fill=COLOR_BLACK,
             font=self.ui.font_bold,
         )
@@ -238,6 +395,8 @@ class RomSelectScreen(Screen):
             "A: Select              B: Back",
             fill=COLOR_BLACK,
         )
+
+    def _draw(self) -> None:
         self._widget.render(self.ui, 6, 18, 150, 108)
 
         # Draw error modal
@@ -252,13 +411,82 @@ class RomSelectScreen(Screen):
                 outline=COLOR_BLACK, fill=COLOR_WHITE)
             self.ui.draw.text((draw_x, draw_y), self._error, fill=COLOR_BLACK)
 
-        self.ui.show_framebuffer()
+
+class OptionsScreen(Screen):
+    def __init__(self, ui: UI) -> None:
+        self.ui = ui
+        # Only this screen changes the options, so they are read once (each read can be a round trip to the
+        # main process, see `render`).
+        session = self.ui.system.session
+        self._auto_resume = session.auto_resume
+        self._input_mode = session.input_mode
+        self._widget = SelectWidget([self._auto_resume_label(), self._input_mode_label(), "Back"])
+
+    def on_attach(self) -> None:
+        self._render()
+
+    def _auto_resume_label(self) -> str:
+        return "Resume at boot: " + ("On" if self._auto_resume else "Off")
+
+    def _input_mode_label(self) -> str:
+        return "Input: " + self._input_mode.value.capitalize()
+
+    def on_button_event(self, button: Button, event: ButtonEvent) -> None:
+        if event == ButtonEvent.PRESSED:
+            if button == Button.UP:
+                self._widget.move_up()
+            if button == Button.DOWN:
+                self._widget.move_down()
+            if button == Button.B:
+                self.ui.set_screen(MainMenuScreen(self.ui))
+                return
+            if button == Button.A:
+                if self._widget.pos == 0:
+                    # Toggle resuming the last game at boot
+                    self._auto_resume = not self._auto_resume
+                    session = self.ui.system.session
+                    session.auto_resume = self._auto_resume
+                    session.save()
+                    self._widget.items[0] = self._auto_resume_label()
+                if self._widget.pos == 1:
+                    # Cycle through live, recorded, and replayed input
+                    modes = list(InputMode)
+                    self._input_mode = modes[(modes.index(self._input_mode) + 1) % len(modes)]
+                    session = self.ui.system.session
+                    session.input_mode = self._input_mode
+                    session.save()
+                    self._widget.items[1] = self._input_mode_label()
+                if self._widget.pos == 2:
+                    # Back
+                    self.ui.set_screen(MainMenuScreen(self.ui))
+                    return
+            self._render()
+
+    @trace.traced()
+    def _render(self) -> None:
+        key = ("options", self._widget.pos, self._auto_resume, self._input_mode)
+        self.ui.show_frame(self.ui.cached_frame(key, self._draw))
+
+    def _draw(self) -> None:
+        self.ui.draw.rectangle([(0, 0), (self.ui.width, self.ui.height)], fill=COLOR_BG)
+        self.ui.draw.text(
+            (4, 4),
+            "Options",
+            fill=COLOR_BLACK,
+            font=self.ui.font_bold,
+        )
+        self._widget.render(self.ui, 10, 30, 140, 50)
 
 
 class StatsScreen(Screen):
+    # Number of ROMs listed on the history page
+    WORST_COUNT = 5
+
     def __init__(self, ui: UI, prev_screen: Screen) -> None:
         self.ui = ui
         self._prev_screen = prev_screen
+        # Page 0 is the current session, page 1 the ROMs with the worst stall rates.
+        self._page = 0
 
     def on_attach(self) -> None:
         self._render()
@@ -268,36 +496,111 @@ class StatsScreen(Screen):
             if button == Button.B:
                 self.ui.set_screen(self._prev_screen)
                 return
+            if button == Button.A:
+                self._page = 1 - self._page
+                self._render()
 
     def _get_stats(self) -> List[str]:
-        # The 'clocks' stat register overflows in 8.53 minutes, so estimate it instead.
-        clocks = self.ui.system.gameboy.get_playtime() * Gameboy.CLOCK_RATE
         stats = self.ui.system.gameboy.get_stats()
-        stall_rate = stats['stalls'] / (clocks + 1)
+        stall_rate = stats['stalls'] / (stats['clocks'] + stats['stalls'] + 1)
         hit_rate = stats['cache_hits'] / (stats['cache_misses'] + stats['cache_hits'] + 1)
         return [
-            f"Clocks: {int(clocks):,}",
+            f"Clocks: {stats['clocks']:,}",
             f"Stalls: {stats['stalls']:,}",
             f"Stall %: {(stall_rate * 100):0.3f}",
             f"Cache Hit %: {(hit_rate * 100):0.3f}",
         ]
 
+    def _get_worst(self) -> List[str]:
+        roms = self.ui.system.history.worst(self.WORST_COUNT)
+        if not roms:
+            return ["No history yet"]
+        return [f"{(rom.stall_rate * 100):6.3f} {rom.title[:11]}" for rom in roms]
+
+    # Region inside the box that holds the title and the stats text.
+    TEXT_REGION = (21, 21, 160 - 20, 144 - 20)
+
+    @trace.traced()
     def _render(self) -> None:
+        background = self.ui.cached_frame("stats", self._draw_background)
+        self.ui.show_frame(self.ui.render_region(background, self.TEXT_REGION, self._draw))
+
+    def _draw_background(self) -> None:
         self.ui.draw.rectangle([(0, 0), (self.ui.width, self.ui.height)], fill=COLOR_TRANSPARENT)
         self.ui.draw.rectangle([(20, 20), (160 - 20, 144 - 20)], fill=COLOR_BG)
         self.ui.draw.rectangle([(20, 20), (160 - 20, 144 - 20)], outline=COLOR_BLACK)
+
+    def _draw(self) -> None:
         self.ui.draw.text(
             (28, 28),
-            "Stats",
+            "Stats" if self._page == 0 else "Worst Stall %",
             fill=COLOR_BLACK,
             font=self.ui.font_bold,
         )
         self.ui.draw.multiline_text(
             (28, 28 + 14),
-            "\n".join(self._get_stats()),
+            "\n".join(self._get_stats() if self._page == 0 else self._get_worst()),
             fill=COLOR_BLACK,
         )
-        self.ui.show_framebuffer()
+
+class Hud:
+    """Performance overlay, drawn over the running game and refreshed in the background."""
+    REFRESH_INTERVAL = 0.25
+    LINE = 0
+    # Frame rate of the Game Boy LCD at full speed
+    FULL_SPEED_FPS = 59.73
+
+    def __init__(self, ui: UI) -> None:
+        self.ui = ui
+        self.enabled = False
+        self.image = Image.new("I", (ui.width, OVERLAY_LINES), COLOR_TRANSPARENT)
+        self.draw = ImageDraw.Draw(self.image)
+        self.draw.font = ui.font
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        self.ui.system.gameboy.set_overlay(False)
+
+    def _run(self) -> None:
+        gameboy = self.ui.system.gameboy
+        clock_rate = gameboy.CLOCK_RATE
+        last_time = time.monotonic()
+        last_stats = gameboy.get_stats()
+        shown = False
+        while not self._stop_event.wait(self.REFRESH_INTERVAL):
+            now = time.monotonic()
+            stats = gameboy.get_stats()
+            # The stats are extended to 64 bits, so they only go backwards when the Gameboy is reset.
+            delta = {k: max(0, stats[k] - last_stats[k]) for k in stats}
+            fps = self.FULL_SPEED_FPS * delta["clocks"] / (clock_rate * (now - last_time))
+            stall_rate = delta["stalls"] / (delta["clocks"] + delta["stalls"] + 1)
+            hit_rate = delta["cache_hits"] / (delta["cache_hits"] + delta["cache_misses"] + 1)
+            last_time, last_stats = now, stats
+
+            text = f"{fps:0.1f} fps  S {(stall_rate * 100):0.1f}%  C {(hit_rate * 100):0.1f}%"
+            bbox = self.draw.textbbox((1, 1), text)
+            self.draw.rectangle([(0, 0), (self.ui.width, OVERLAY_LINES)], fill=COLOR_TRANSPARENT)
+            self.draw.rectangle([(0, 0), (bbox[2], OVERLAY_LINES - 1)], fill=COLOR_WHITE)
+            self.draw.text((1, 1), text, fill=COLOR_BLACK)
+            gameboy.copy_overlay(image_to_frame(self.image))
+            if not shown:
+                # Only show the overlay once it has been filled.
+                gameboy.set_overlay(True, self.LINE)
+                shown = True
+
 
 class ListWidget:
     def __init__(self, items: List[str], lines: int) -> None:
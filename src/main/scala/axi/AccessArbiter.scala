@@ -0,0 +1,88 @@
+package axi
+
+import chisel3._
+
+/**
+ * A requester's port on an AccessArbiter.
+ *
+ * An access is requested by toggling `request`, and has completed once `done` has been toggled to match it. This
+ * lets requests and completions cross clock domains (through registers) without being missed, or mistaken for the
+ * previous one.
+ */
+class ArbiterAccessIo(addrWidth: Int, dataWidth: Int) extends Bundle {
+  /** Toggled to request an access. The other inputs must be held until the access has completed. */
+  val request = Input(Bool())
+  /** Toggled when the access has completed */
+  val done = Output(Bool())
+  val address = Input(UInt(addrWidth.W))
+  val read = Input(Bool())
+  /** Whether the read bypasses the cache */
+  val uncached = Input(Bool())
+  val writeData = Input(UInt(dataWidth.W))
+  val writeStrobe = Input(UInt((dataWidth / 8).W))
+  /** The data read by this requester's last access */
+  val readData = Output(UInt(dataWidth.W))
+}
+
+/**
+ * Shares a SimpleCache between two requesters. The `high` requester has priority: the `low` requester's accesses
+ * only start when the cache is idle and no `high` access is waiting.
+ */
+class AccessArbiter(addrWidth: Int, dataWidth: Int) extends Module {
+  val io = IO(new Bundle {
+    val high = new ArbiterAccessIo(addrWidth, dataWidth)
+    val low = new ArbiterAccessIo(addrWidth, dataWidth)
+
+    // Connected to the cache
+    val enable = Output(Bool())
+    val address = Output(UInt(addrWidth.W))
+    val read = Output(Bool())
+    val uncached = Output(Bool())
+    val writeData = Output(UInt(dataWidth.W))
+    val writeStrobe = Output(UInt((dataWidth / 8).W))
+    val busy = Input(Bool())
+    val readData = Input(UInt(dataWidth.W))
+  })
+
+  val highDone = RegInit(false.B)
+  val highReadData = Reg(UInt(dataWidth.W))
+  val lowDone = RegInit(false.B)
+  val lowReadData = Reg(UInt(dataWidth.W))
+  io.high.done := highDone
+  io.high.readData := highReadData
+  io.low.done := lowDone
+  io.low.readData := lowReadData
+  val highPending = io.high.request =/= highDone
+  val lowPending = io.low.request =/= lowDone
+
+  // The access in flight, and who it is for
+  val accessActive = RegInit(false.B)
+  val accessLow = RegInit(false.B)
+  // The cache doesn't report busy until the cycle after it's enabled.
+  val accessStarted = RegInit(false.B)
+  val startHigh = !accessActive && highPending
+  val startLow = !accessActive && !highPending && lowPending
+  accessStarted := startHigh || startLow
+  when (startHigh || startLow) {
+    accessActive := true.B
+    accessLow := startLow
+  } .elsewhen (accessActive && !accessStarted && !io.busy) {
+    accessActive := false.B
+    when (accessLow) {
+      lowDone := !lowDone
+      lowReadData := io.readData
+    } .otherwise {
+      highDone := !highDone
+      highReadData := io.readData
+    }
+  }
+
+  // The cache needs the address to stay the same for the whole access.
+  val selectLow = Mux(accessActive, accessLow, startLow)
+  io.enable := startHigh || startLow
+  io.address := Mux(selectLow, io.low.address, io.high.address)
+  io.read := Mux(selectLow, io.low.read, io.high.read)
+  io.uncached := Mux(selectLow, io.low.uncached, io.high.uncached)
+  io.writeData := Mux(selectLow, io.low.writeData, io.high.writeData)
+  io.writeStrobe := Mux(selectLow, io.low.writeStrobe, io.high.writeStrobe)
+}
@@ -23,6 +23,8 @@ object SimpleCacheState extends ChiselEnum {
 class SimpleCache(addrWidth: Int, dataWidth: Int, indexWidth: Int) extends Module {
   val io = IO(new AxiLiteInitiatorIo(addrWidth, dataWidth) {
     val cacheInvalidate = Input(Bool())
+    /** Whether the read bypasses the cache (not filling it, and not counted in the stats). */
+    val uncached = Input(Bool())
 
     val statHits = Output(UInt(32.W))
     val statMisses = Output(UInt(32.W))
@@ -71,6 +73,7 @@ class SimpleCache(addrWidth: Int, dataWidth: Int, indexWidth: Int) extends Modul
   io.busy := state =/= SimpleCacheState.idle
   io.readData := readData
   val pendingRead = Reg(Bool())
+  val pendingUncached = Reg(Bool())
   val pendingTag = Reg(UInt(tagWidth.W))
   val pendingIndex = Reg(UInt(indexWidth.W))
 
@@ -81,13 +84,17 @@ class SimpleCache(addrWidth: Int, dataWidth: Int, indexWidth: Int) extends Modul
         state := SimpleCacheState.waitCache
         cacheEntry := cache.read(addrIndex)
         pendingRead := io.read
+        pendingUncached := io.uncached
         pendingTag := addrTag
         pendingIndex := addrIndex
       }
     }
 
     is (SimpleCacheState.waitCache) {
-      when (pendingRead) {
+      when (pendingRead && pendingUncached) {
+        state := SimpleCacheState.waitMem
+        initiator.io.enable := true.B
+      } .elsewhen (pendingRead) {
         when (cacheHit) {
           state := SimpleCacheState.idle
           readData := cacheEntry.data
@@ -115,6 +122,8 @@ class SimpleCache(addrWidth: Int, dataWidth: Int, indexWidth: Int) extends Modul
 
         when (pendingRead) {
           readData := initiator.io.readData
+        }
+        when (pendingRead && !pendingUncached) {
           val entry = Wire(new CacheEntry(tagWidth, dataWidth))
           entry.tag := pendingTag
           entry.data := initiator.io.readData
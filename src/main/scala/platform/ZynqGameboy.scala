@@ -1,6 +1,6 @@
 package platform
 
-import axi.{AxiLiteInitiator, AxiLiteSignals, AxiLiteTarget, SimpleCache}
+import axi.{AccessArbiter, AxiLiteInitiator, AxiLiteSignals, AxiLiteTarget, SimpleCache}
 import chisel3._
 import chisel3.util._
 import gameboy.apu.ApuOutput
@@ -72,6 +72,7 @@ class ZynqGameboy extends Module {
   val configRegRamMask = RegInit(0.U(17.W))
   val configRegBlitAddress = RegInit(0.U(32.W))
   val configRegBlitControl = RegInit(0.U.asTypeOf(new RegBlitControl))
+  val configRegOverlayControl = RegInit(0.U.asTypeOf(new RegOverlayControl))
   val rtcAccess = Wire(new Mbc3RtcAccess)
   rtcAccess.writeEnable := false.B
   rtcAccess.writeState := DontCare
@@ -113,6 +114,7 @@ class ZynqGameboy extends Module {
     is (Registers.StatNumClocks.id.U) { axiTarget.io.readData := statNumClocks }
     is (Registers.BlitAddress.id.U) { axiTarget.io.readData := configRegBlitAddress }
     is (Registers.BlitControl.id.U) { axiTarget.io.readData := configRegBlitControl.asUInt }
+    is (Registers.OverlayControl.id.U) { axiTarget.io.readData := configRegOverlayControl.asUInt }
     is (Registers.RtcState.id.U) {
       rtcAccess.latchSelect := false.B
       axiTarget.io.readData := rtcAccess.readState.asUInt
@@ -141,6 +143,9 @@ class ZynqGameboy extends Module {
       is (Registers.BlitControl.id.U) {
         configRegBlitControl := axiTarget.io.writeData.asTypeOf(new RegBlitControl)
       }
+      is (Registers.OverlayControl.id.U) {
+        configRegOverlayControl := axiTarget.io.writeData.asTypeOf(new RegOverlayControl)
+      }
       is (Registers.RtcState.id.U) {
         rtcAccess.writeEnable := true.B
         rtcAccess.latchSelect := false.B
@@ -181,6 +186,19 @@ class ZynqGameboy extends Module {
   val framebufferY = RegInit(0.U(8.W))
   val framebufferIndex = (framebufferY * 160.U(8.W)) + framebufferX
 
+  // Overlay, composed over the Game Boy output (filled by blitting with the overlay bit set)
+  val overlayPixels = 160 * RegOverlayControl.Lines
+  val overlayMem = Mem(overlayPixels, UInt(16.W))
+  val overlayY = framebufferY - configRegOverlayControl.line
+  val overlayIndex = (overlayY * 160.U(8.W)) + framebufferX
+  val overlayPixel = overlayMem(overlayIndex(log2Ceil(overlayPixels) - 1, 0))
+  // Bit 15 is transparency -- 1 for visible, 0 for transparent
+  val overlayVisible = configRegOverlayControl.enabled &&
+    framebufferY >= configRegOverlayControl.line &&
+    overlayY < RegOverlayControl.Lines.U &&
+    overlayPixel(15)
+  def composeOverlay(pixel: UInt): UInt = Mux(overlayVisible, overlayPixel(14, 0), pixel)
+
   val prevHblank = RegInit(false.B)
   val prevLcdEnable = RegInit(false.B)
   when (gameboy.io.clockConfig.enable) {
@@ -190,7 +208,7 @@ class ZynqGameboy extends Module {
       // Clear the screen if LCD is disabled.
       io.framebufferWriteEnable := true.B
       io.framebufferWriteAddr := framebufferIndex
-      io.framebufferWriteData := 0x7FFF.U(15.W)
+      io.framebufferWriteData := composeOverlay(0x7FFF.U(15.W))
       when (prevLcdEnable) {
         framebufferX := 0.U
         framebufferY := 0.U
@@ -209,7 +227,7 @@ class ZynqGameboy extends Module {
     } .elsewhen (gameboy.io.ppu.valid) {
       io.framebufferWriteEnable := true.B
       io.framebufferWriteAddr := framebufferIndex
-      io.framebufferWriteData := gameboy.io.ppu.pixel
+      io.framebufferWriteData := composeOverlay(gameboy.io.ppu.pixel)
       framebufferX := framebufferX + 1.U
     }
   }
@@ -251,33 +269,59 @@ class ZynqGameboy extends Module {
   val blitValidCount = RegInit(0.U(3.W))
   val blitMem = RegInit(0.U(64.W))
   val blitReadEnable = RegInit(false.B)
+  // Requests to the AXI initiator (and their completions) are signalled by toggling a bit, so that none are
+  // missed or mistaken for the previous one across the clock domains.
+  val blitRequestToggle = RegInit(false.B)
   val blitActive = configRegBlitControl.start
+  // Overlay blits leave the framebuffer alone, so the Game Boy can keep running during them.
+  val blitOverlay = configRegBlitControl.overlay
+  val blitLastIndex = Mux(blitOverlay, (overlayPixels - 1).U, ((160 * 144) - 1).U)
   val blitCurrent = blitMem.asTypeOf(Vec(4, UInt(16.W)))(blitIndex(1, 0))
   when (blitActive) {
-    io.framebufferWriteAddr := blitIndex
-    io.framebufferWriteData := blitCurrent(14, 0)
+    when (!blitOverlay) {
+      io.framebufferWriteAddr := blitIndex
+      io.framebufferWriteData := blitCurrent(14, 0)
+    }
     when (blitValidCount === 0.U) {
-      blitReadEnable := true.B
+      when (!blitReadEnable) {
+        blitReadEnable := true.B
+        blitRequestToggle := !blitRequestToggle
+      }
     } .otherwise {
       blitIndex := blitIndex + 1.U
       blitValidCount := blitValidCount - 1.U
-      // Bit 15 is transparency -- 1 for visible, 0 for transparent
-      io.framebufferWriteEnable := blitCurrent(15)
+      when (blitOverlay) {
+        overlayMem.write(blitIndex(log2Ceil(overlayPixels) - 1, 0), blitCurrent)
+      } .otherwise {
+        // Bit 15 is transparency -- 1 for visible, 0 for transparent
+        io.framebufferWriteEnable := blitCurrent(15)
+      }
 
-      when (blitIndex === ((160 * 144) - 1).U) {
+      when (blitIndex === blitLastIndex) {
         blitIndex := 0.U
-        blitActive := false.B
+        configRegBlitControl := 0.U.asTypeOf(new RegBlitControl)
         blitReadEnable := false.B
         blitValidCount := 0.U
       }
     }
   }
 
+  // Cartridge accesses start on the rising edge of the data access enable.
+  val cartRequestToggle = RegInit(false.B)
+  when (emuCart.io.dataAccess.enable && !RegNext(emuCart.io.dataAccess.enable, false.B)) {
+    cartRequestToggle := !cartRequestToggle
+  }
+
   // AXI Initiator for DRAM access -- runs ~100 MHz (integer multiple of module clock).
-  val axiInitiatorReadData = Wire(UInt(64.W))
-  val axiInitiatorReadValid = Wire(Bool())
-  val axiInitiatorReadDataBuffer = RegNext(axiInitiatorReadData)
-  val axiInitiatorReadValidBuffer = RegNext(axiInitiatorReadValid)
+  // It is shared by the emulated cartridge and blits, which can run at the same time for overlay blits.
+  val axiInitiatorCartData = Wire(UInt(64.W))
+  val axiInitiatorCartDone = Wire(Bool())
+  val axiInitiatorBlitData = Wire(UInt(64.W))
+  val axiInitiatorBlitDone = Wire(Bool())
+  val axiInitiatorCartDataBuffer = RegNext(axiInitiatorCartData)
+  val axiInitiatorCartDoneBuffer = RegNext(axiInitiatorCartDone, false.B)
+  val axiInitiatorBlitDataBuffer = RegNext(axiInitiatorBlitData)
+  val axiInitiatorBlitDoneBuffer = RegNext(axiInitiatorBlitDone, false.B)
   val axiInitiatorStatHits = Wire(UInt(32.W))
   val axiInitiatorStatMisses = Wire(UInt(32.W))
   val axiInitiator = withClock (io.clock_axi_dram) {
@@ -287,40 +331,45 @@ class ZynqGameboy extends Module {
     axiInitiatorStatHits := axiInitiator.io.statHits
     axiInitiatorStatMisses := axiInitiator.io.statMisses
 
-    val bufferedDataEnable = RegNext(emuCart.io.dataAccess.enable)
-    val bufferedDataEnableLast = RegNext(bufferedDataEnable)
+    // Cartridge accesses have priority, so blits only slow the game down by at most one access.
+    val arbiter = Module(new AccessArbiter(32, 64))
+    axiInitiator.io.enable := arbiter.io.enable
+    axiInitiator.io.address := arbiter.io.address
+    axiInitiator.io.read := arbiter.io.read
+    axiInitiator.io.uncached := arbiter.io.uncached
+    axiInitiator.io.writeData := arbiter.io.writeData
+    axiInitiator.io.writeStrobe := arbiter.io.writeStrobe
+    arbiter.io.busy := axiInitiator.io.busy
+    arbiter.io.readData := axiInitiator.io.readData
+
     val bufferedDataAddr = RegNext(emuCart.io.dataAccess.address)
     val bufferedDataSelectRom = RegNext(emuCart.io.dataAccess.selectRom)
     val bufferedDataWriteData = RegNext(emuCart.io.dataAccess.dataWrite)
     val bufferedDataWrite = RegNext(emuCart.io.dataAccess.write)
+    val accessAddress = Mux(
+      bufferedDataSelectRom,
+      configRegRomAddress + (bufferedDataAddr & configRegRomMask),
+      configRegRamAddress + (bufferedDataAddr & configRegRamMask),
+    )
+    arbiter.io.high.request := RegNext(cartRequestToggle, false.B)
+    arbiter.io.high.address := Cat(accessAddress(31, 3), 0.U(3.W))
+    arbiter.io.high.read := !bufferedDataWrite
+    arbiter.io.high.uncached := false.B
+    arbiter.io.high.writeData := Fill(8, bufferedDataWriteData)
+    arbiter.io.high.writeStrobe := 1.U << accessAddress(2, 0)
+    axiInitiatorCartData := arbiter.io.high.readData
+    axiInitiatorCartDone := arbiter.io.high.done
 
-    val bufferedBlitActive = RegNext(blitActive)
-    val bufferedBlitReadEnable = RegNext(blitReadEnable)
-    val bufferedBlitReadEnableLast = RegNext(bufferedBlitReadEnable)
-    val bufferedBlitIndex = RegNext(blitIndex)
-
-    when (bufferedBlitActive) {
-      // Handle accessing blit data
-      axiInitiator.io.address := configRegBlitAddress + (bufferedBlitIndex << 1.U)
-      axiInitiator.io.enable := bufferedBlitReadEnable && !bufferedBlitReadEnableLast
-      axiInitiator.io.read := true.B
-      axiInitiator.io.writeData := DontCare
-      axiInitiator.io.writeStrobe := DontCare
-    } .otherwise {
-      val accessAddress = Mux(
-        bufferedDataSelectRom,
-        configRegRomAddress + (bufferedDataAddr & configRegRomMask),
-        configRegRamAddress + (bufferedDataAddr & configRegRamMask),
-      )
-      axiInitiator.io.address := Cat(accessAddress(31, 3), 0.U(3.W))
-      axiInitiator.io.enable := bufferedDataEnable && !bufferedDataEnableLast
-      axiInitiator.io.read := !bufferedDataWrite
-      axiInitiator.io.writeData := Fill(8, bufferedDataWriteData)
-      axiInitiator.io.writeStrobe := 1.U << accessAddress(2, 0)
-    }
-
-    axiInitiatorReadData := axiInitiator.io.readData
-    axiInitiatorReadValid := !axiInitiator.io.busy
+    // Handle accessing blit data
+    arbiter.io.low.request := RegNext(blitRequestToggle, false.B)
+    arbiter.io.low.address := configRegBlitAddress + (RegNext(blitIndex) << 1.U)
+    arbiter.io.low.read := true.B
+    // The blit buffer is rewritten by the PS between blits, so it must not be cached.
+    arbiter.io.low.uncached := true.B
+    arbiter.io.low.writeData := DontCare
+    arbiter.io.low.writeStrobe := DontCare
+    axiInitiatorBlitData := arbiter.io.low.readData
+    axiInitiatorBlitDone := arbiter.io.low.done
 
     axiInitiator
   }
@@ -328,15 +377,15 @@ class ZynqGameboy extends Module {
   statCacheHits := axiInitiatorStatHits
   statCacheMisses := axiInitiatorStatMisses
 
-  emuCart.io.dataAccess.dataRead := axiInitiatorReadDataBuffer
+  emuCart.io.dataAccess.dataRead := axiInitiatorCartDataBuffer
     .asTypeOf(Vec(8, UInt(8.W)))(
       emuCart.io.dataAccess.address(2, 0)
     )
-  emuCart.io.dataAccess.valid := !blitActive && axiInitiatorReadValidBuffer
+  emuCart.io.dataAccess.valid := axiInitiatorCartDoneBuffer === cartRequestToggle
 
-  when (blitActive && RegNext(blitReadEnable) && RegNext(blitReadEnable) && blitReadEnable && axiInitiatorReadValidBuffer) {
+  when (blitActive && blitReadEnable && axiInitiatorBlitDoneBuffer === blitRequestToggle) {
     blitReadEnable := false.B
     blitValidCount := 4.U
-    blitMem := axiInitiatorReadDataBuffer
+    blitMem := axiInitiatorBlitDataBuffer
   }
-}
\ No newline at end of file
+}
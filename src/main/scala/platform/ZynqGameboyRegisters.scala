@@ -19,6 +19,7 @@ object Registers extends Enumeration {
   /// Framebuffer: index = 64
   val BlitControl = Value(64)
   val BlitAddress = Value(65)
+  val OverlayControl = Value(66)
 
   /// Debug: index = 96
   val CpuDebug1 = Value(96)
@@ -64,6 +65,25 @@ class RegCpuDebug3 extends Bundle {
 }
 
 class RegBlitControl extends Bundle {
+  // Bit 1 [R/W]: whether to blit to the overlay (rather than the framebuffer)
+  val overlay = Bool()
   // Bit 0 [R/W]: whether the blit operation should run
   val start = Bool()
+}
+
+/**
+ * Overlay Control
+ *
+ * The overlay is a full-width strip of [[RegOverlayControl.Lines]] lines that is composed over the
+ * Game Boy output as it is written to the framebuffer, so it can be shown while the game is running.
+ */
+class RegOverlayControl extends Bundle {
+  // Bits 8-1 [R/W]: first line of the screen covered by the overlay
+  val line = UInt(8.W)
+  // Bit 0 [R/W]: whether the overlay is shown
+  val enabled = Bool()
+}
+
+object RegOverlayControl {
+  val Lines = 10
 }
\ No newline at end of file
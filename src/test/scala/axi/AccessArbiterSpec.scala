@@ -0,0 +1,177 @@
+package axi
+
+import chisel3._
+import chiseltest._
+import org.scalatest.freespec.AnyFreeSpec
+
+import scala.collection.mutable
+
+class AccessArbiterSpec extends AnyFreeSpec with ChiselScalatestTester {
+  private def memData(address: BigInt): BigInt = (address * 3 + 1) & ((BigInt(1) << 64) - 1)
+
+  /**
+   * Runs cartridge accesses (high) at the same time as a blit (low), with a model of the cache that is busy for
+   * `latency` cycles after each access starts.
+   */
+  private def runConcurrent(latency: Int, cartInterval: Int, numBlitReads: Int, numCartReads: Int): Unit = {
+    test(new AccessArbiter(32, 64)) { dut =>
+      dut.io.high.read.poke(true)
+      dut.io.high.uncached.poke(false)
+      dut.io.high.writeData.poke(0)
+      dut.io.high.writeStrobe.poke(0)
+      dut.io.low.read.poke(true)
+      dut.io.low.uncached.poke(true)
+      dut.io.low.writeData.poke(0)
+      dut.io.low.writeStrobe.poke(0)
+
+      // Cache model
+      var cacheBusyCycles = 0
+      var cacheStarted = false
+      var cacheAddress = BigInt(0)
+      var cacheReadData = BigInt(0)
+      val issued = mutable.ArrayBuffer[BigInt]()
+
+      // Requesters
+      var highRequest = false
+      var highDone = false
+      var highAddress = BigInt(0)
+      var cartIssued = 0
+      var cartReceived = 0
+      var lowRequest = false
+      var lowDone = false
+      var blitIssued = 0
+      var blitReceived = 0
+
+      def blitAddress(i: Int): BigInt = 0x10000 + i * 8
+      def cartAddress(i: Int): BigInt = 0x80000 + i * 8
+
+      var cycle = 0
+      while ((blitReceived < numBlitReads || cartReceived < numCartReads) && cycle < 10000) {
+        dut.io.busy.poke(cacheBusyCycles > 0)
+        dut.io.readData.poke(cacheReadData)
+
+        // The blit reads sequentially, requesting the next beat once the last one is done.
+        if (lowRequest == lowDone && blitIssued < numBlitReads) {
+          lowRequest = !lowRequest
+          blitIssued += 1
+        }
+        dut.io.low.request.poke(lowRequest)
+        dut.io.low.address.poke(blitAddress(blitIssued - 1 max 0))
+
+        // The cartridge reads every `cartInterval` cycles.
+        if (highRequest == highDone && cartIssued < numCartReads && cycle % cartInterval == 0) {
+          highRequest = !highRequest
+          highAddress = cartAddress(cartIssued)
+          cartIssued += 1
+        }
+        dut.io.high.request.poke(highRequest)
+        dut.io.high.address.poke(highAddress)
+
+        if (dut.io.enable.peekBoolean()) {
+          assert(cacheBusyCycles == 0 && !cacheStarted, s"access started while the cache was busy at cycle $cycle")
+          val address = dut.io.address.peekInt()
+          if (highRequest != highDone) {
+            assert(address == highAddress, s"cartridge access didn't have priority at cycle $cycle")
+            dut.io.uncached.expect(false)
+          } else {
+            dut.io.uncached.expect(true)
+          }
+          dut.io.read.expect(true)
+          issued += address
+          cacheAddress = address
+          cacheStarted = true
+        }
+
+        dut.clock.step()
+        cycle += 1
+
+        if (cacheStarted) {
+          cacheStarted = false
+          cacheBusyCycles = latency
+        } else if (cacheBusyCycles > 0) {
+          cacheBusyCycles -= 1
+          if (cacheBusyCycles == 0) {
+            cacheReadData = memData(cacheAddress)
+          }
+        }
+
+        if (dut.io.high.done.peekBoolean() != highDone) {
+          highDone = !highDone
+          assert(highDone == highRequest)
+          dut.io.high.readData.expect(memData(cartAddress(cartReceived)))
+          cartReceived += 1
+        }
+        if (dut.io.low.done.peekBoolean() != lowDone) {
+          lowDone = !lowDone
+          assert(lowDone == lowRequest)
+          dut.io.low.readData.expect(memData(blitAddress(blitReceived)))
+          blitReceived += 1
+        }
+      }
+
+      assert(blitReceived == numBlitReads)
+      assert(cartReceived == numCartReads)
+      // Every beat was read exactly once.
+      val expected = (0 until numBlitReads).map(blitAddress) ++ (0 until numCartReads).map(cartAddress)
+      assert(issued.sorted == expected.sorted)
+    }
+  }
+
+  "cartridge has priority over a pending blit" in {
+    test(new AccessArbiter(32, 64)) { dut =>
+      dut.io.busy.poke(false)
+      dut.io.high.address.poke(0x100)
+      dut.io.low.address.poke(0x200)
+      dut.io.high.uncached.poke(false)
+      dut.io.low.uncached.poke(true)
+      dut.io.enable.expect(false)
+
+      // Both requested at once: the cartridge goes first.
+      dut.io.high.request.poke(true)
+      dut.io.low.request.poke(true)
+      dut.io.enable.expect(true)
+      dut.io.address.expect(0x100)
+      dut.io.uncached.expect(false)
+      dut.clock.step()
+
+      // The address is held while the cache is busy.
+      dut.io.busy.poke(true)
+      dut.io.readData.poke(0xAA)
+      for (_ <- 0 to 3) {
+        dut.io.enable.expect(false)
+        dut.io.address.expect(0x100)
+        dut.clock.step()
+      }
+      dut.io.busy.poke(false)
+      dut.io.enable.expect(false)
+      dut.clock.step()
+      dut.io.high.done.expect(true)
+      dut.io.high.readData.expect(0xAA)
+      dut.io.low.done.expect(false)
+
+      // Then the blit.
+      dut.io.enable.expect(true)
+      dut.io.address.expect(0x200)
+      dut.io.uncached.expect(true)
+      dut.clock.step()
+      dut.io.busy.poke(true)
+      dut.io.readData.poke(0xBB)
+      dut.io.enable.expect(false)
+      dut.clock.step()
+      dut.io.busy.poke(false)
+      dut.clock.step()
+      dut.io.low.done.expect(true)
+      dut.io.low.readData.expect(0xBB)
+      dut.io.high.readData.expect(0xAA)
+      dut.io.enable.expect(false)
+    }
+  }
+
+  "concurrent blit and cartridge reads (cache hits)" in {
+    runConcurrent(latency = 1, cartInterval = 3, numBlitReads = 64, numCartReads = 40)
+  }
+
+  "concurrent blit and cartridge reads (cache misses)" in {
+    runConcurrent(latency = 6, cartInterval = 5, numBlitReads = 64, numCartReads = 40)
+  }
+}
@@ -0,0 +1,98 @@
+package axi
+
+import chisel3._
+import chiseltest._
+import org.scalatest.freespec.AnyFreeSpec
+
+import scala.collection.mutable
+
+class SimpleCacheSpec extends AnyFreeSpec with ChiselScalatestTester {
+  private def setup(dut: SimpleCache): Unit = {
+    dut.io.enable.poke(false)
+    dut.io.read.poke(true)
+    dut.io.uncached.poke(false)
+    dut.io.writeData.poke(0)
+    dut.io.writeStrobe.poke(0)
+    dut.io.cacheInvalidate.poke(false)
+    dut.io.signals.arready.poke(false)
+    dut.io.signals.rvalid.poke(false)
+    dut.io.signals.awready.poke(false)
+    dut.io.signals.wready.poke(false)
+    dut.io.signals.bvalid.poke(false)
+  }
+
+  /** Reads `address` through the cache, serving memory reads from `memory`. Returns the data and the memory reads. */
+  private def read(
+    dut: SimpleCache,
+    memory: mutable.Map[BigInt, BigInt],
+    address: BigInt,
+    uncached: Boolean,
+  ): (BigInt, Int) = {
+    dut.io.address.poke(address)
+    dut.io.read.poke(true)
+    dut.io.uncached.poke(uncached)
+    dut.io.enable.poke(true)
+    dut.clock.step()
+    dut.io.enable.poke(false)
+
+    var memoryReads = 0
+    var cycles = 0
+    while (dut.io.busy.peekBoolean()) {
+      assert(cycles < 100, "cache access didn't complete")
+      if (dut.io.signals.arvalid.peekBoolean()) {
+        val readAddress = dut.io.signals.araddr.peekInt()
+        memoryReads += 1
+        dut.io.signals.arready.poke(true)
+        dut.clock.step()
+        dut.io.signals.arready.poke(false)
+        dut.io.signals.rdata.poke(memory(readAddress))
+        dut.io.signals.rvalid.poke(true)
+        dut.clock.step()
+        dut.io.signals.rvalid.poke(false)
+      } else {
+        dut.clock.step()
+      }
+      cycles += 1
+    }
+    (dut.io.readData.peekInt(), memoryReads)
+  }
+
+  "cached reads" in {
+    test(new SimpleCache(32, 64, indexWidth = 4)) { dut =>
+      setup(dut)
+      val memory = mutable.Map[BigInt, BigInt](BigInt(0x100) -> BigInt(0x1111))
+
+      assert(read(dut, memory, 0x100, uncached = false) == (BigInt(0x1111), 1))
+      assert(read(dut, memory, 0x100, uncached = false) == (BigInt(0x1111), 0))
+      dut.io.statHits.expect(1)
+      dut.io.statMisses.expect(1)
+    }
+  }
+
+  "uncached reads bypass the cache" in {
+    test(new SimpleCache(32, 64, indexWidth = 4)) { dut =>
+      setup(dut)
+      val memory = mutable.Map[BigInt, BigInt](BigInt(0x100) -> BigInt(0x1111), BigInt(0x208) -> BigInt(0x2222))
+
+      // Fill the cache, then change memory behind it.
+      assert(read(dut, memory, 0x100, uncached = false) == (BigInt(0x1111), 1))
+      memory(0x100) = 0x3333
+
+      // Uncached reads go to memory even when the address is cached, and aren't counted.
+      assert(read(dut, memory, 0x100, uncached = true) == (BigInt(0x3333), 1))
+      dut.io.statHits.expect(0)
+      dut.io.statMisses.expect(1)
+
+      // They don't fill the cache either.
+      assert(read(dut, memory, 0x208, uncached = true) == (BigInt(0x2222), 1))
+      assert(read(dut, memory, 0x208, uncached = false) == (BigInt(0x2222), 1))
+      dut.io.statHits.expect(0)
+      dut.io.statMisses.expect(2)
+
+      // Or replace what's there.
+      assert(read(dut, memory, 0x100, uncached = false) == (BigInt(0x1111), 0))
+      dut.io.statHits.expect(1)
+      dut.io.statMisses.expect(2)
+    }
+  }
+}